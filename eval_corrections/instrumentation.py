@@ -0,0 +1,315 @@
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO, Union
+
+import numpy as np
+import pandas as pd
+
+
+class _ProfilerState:
+    """
+    Global switches and sinks of the stage instrumentation.
+
+    Attributes:
+        enabled: Whether stages are recorded at all.
+        trace_memory: Whether peak memory is traced with tracemalloc.
+        profile_dir: Directory for per-stage cProfile dumps, None disables profiling.
+        output: Stream the JSON traces are written to, None keeps them in memory only.
+        records: All records collected since the last reset.
+    """
+    def __init__(self):
+        self.enabled: bool = False
+        self.trace_memory: bool = False
+        self.profile_dir: Optional[str] = None
+        self.output: Optional[TextIO] = None
+        self.owns_output: bool = False
+        self.owns_tracemalloc: bool = False
+        self.records: List[Dict[str, Any]] = []
+        self.sequence: int = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+
+_STATE = _ProfilerState()
+
+
+def enable(output: Union[str, TextIO, None] = None, trace_memory: bool = True,
+           profile_dir: Optional[str] = None) -> None:
+    """
+    Enable stage instrumentation.
+
+    Args:
+        output (str or TextIO or None): File path or stream for JSON-lines traces, None keeps records in memory.
+        trace_memory (bool): Trace peak memory of each stage with tracemalloc.
+        profile_dir (str or None): Directory to dump a cProfile file per top-level profiled stage.
+    """
+    disable()
+
+    if isinstance(output, str):
+        _STATE.output = open(output, 'a')
+        _STATE.owns_output = True
+    else:
+        _STATE.output = output
+        _STATE.owns_output = False
+
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+    _STATE.profile_dir = profile_dir
+
+    _STATE.trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _STATE.owns_tracemalloc = True
+
+    _STATE.enabled = True
+
+
+def disable() -> None:
+    """
+    Disable stage instrumentation and close the trace file if it was opened by `enable`.
+    """
+    _STATE.enabled = False
+
+    if _STATE.owns_output and _STATE.output is not None:
+        _STATE.output.close()
+    _STATE.output = None
+    _STATE.owns_output = False
+
+    if _STATE.owns_tracemalloc and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _STATE.owns_tracemalloc = False
+    _STATE.trace_memory = False
+    _STATE.profile_dir = None
+
+
+def is_enabled() -> bool:
+    """
+    Returns:
+        bool: True if stage instrumentation is enabled.
+    """
+    return _STATE.enabled
+
+
+def get_records() -> List[Dict[str, Any]]:
+    """
+    Returns:
+        List[Dict[str, Any]]: Copies of all stage records collected since the last reset.
+    """
+    with _STATE.lock:
+        return [dict(record) for record in _STATE.records]
+
+
+def reset_records() -> None:
+    """
+    Drop all collected stage records.
+    """
+    with _STATE.lock:
+        _STATE.records = []
+
+
+def records_to_dataframe() -> pd.DataFrame:
+    """
+    Converts the collected stage records into a Pandas DataFrame.
+
+    Returns:
+        pd.DataFrame: One row per finished stage, in order of completion.
+    """
+    return pd.DataFrame(get_records())
+
+
+def count_rows(obj: Any) -> Optional[int]:
+    """
+    Count rows of a stage input or output.
+
+    Args:
+        obj (Any): DataFrame, array, collection or tuple of those.
+
+    Returns:
+        int or None: Number of rows, None if the object has no meaningful row count.
+    """
+    if isinstance(obj, (pd.DataFrame, pd.Series, np.ndarray, list, set, dict)):
+        return len(obj)
+    if isinstance(obj, tuple):
+        for item in obj:
+            rows = count_rows(item)
+            if rows is not None:
+                return rows
+    return None
+
+
+def __input_rows(args: tuple, kwargs: dict) -> Optional[int]:
+    """
+    Sum row counts of all DataFrame arguments, including lists of DataFrames.
+
+    Args:
+        args (tuple): Positional arguments of the stage.
+        kwargs (dict): Keyword arguments of the stage.
+
+    Returns:
+        int or None: Total number of input rows, None if no DataFrame was passed.
+    """
+    total = None
+    for arg in list(args) + list(kwargs.values()):
+        if isinstance(arg, pd.DataFrame):
+            frames = [arg]
+        elif isinstance(arg, (list, tuple)) and arg and all(isinstance(item, pd.DataFrame) for item in arg):
+            frames = arg
+        else:
+            continue
+        total = (total or 0) + sum(len(frame) for frame in frames)
+    return total
+
+
+def __emit(record: Dict[str, Any]) -> None:
+    """
+    Store a finished stage record and write it to the configured output as one JSON line.
+
+    Args:
+        record (Dict[str, Any]): The stage record.
+    """
+    with _STATE.lock:
+        _STATE.records.append(record)
+        if _STATE.output is not None:
+            _STATE.output.write(json.dumps(record) + '\n')
+            _STATE.output.flush()
+
+
+def __stack() -> List[Dict[str, Any]]:
+    """
+    Returns:
+        List[Dict[str, Any]]: The stack of currently open stages of this thread.
+    """
+    stack = getattr(_STATE.local, 'stack', None)
+    if stack is None:
+        stack = _STATE.local.stack = []
+    return stack
+
+
+@contextmanager
+def stage(name: str, rows_in: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Record wall time, CPU time, peak traced memory and row counts of a block of code.
+
+    The yielded record can be updated inside the block, e.g. `record['rows_out'] = len(df)`.
+    When instrumentation is disabled, a throwaway record is yielded and nothing is measured.
+
+    Args:
+        name (str): Name of the stage.
+        rows_in (int or None): Number of input rows.
+
+    Yields:
+        Dict[str, Any]: The record of the stage.
+    """
+    if not _STATE.enabled:
+        yield {}
+        return
+
+    stack = __stack()
+    with _STATE.lock:
+        _STATE.sequence += 1
+        sequence = _STATE.sequence
+
+    record = {
+        'stage': name,
+        'parent': stack[-1]['record']['stage'] if stack else None,
+        'depth': len(stack),
+        'sequence': sequence,
+        'pid': os.getpid(),
+        'rows_in': rows_in,
+        'rows_out': None,
+    }
+    frame = {'record': record, 'peak': 0}
+
+    memory_start = 0
+    if _STATE.trace_memory and tracemalloc.is_tracing():
+        memory_start, peak_so_far = tracemalloc.get_traced_memory()
+        # keep the parent's peak up to here, the reset below would discard it
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak_so_far)
+        tracemalloc.reset_peak()
+
+    profiler = None
+    if _STATE.profile_dir is not None and not any(item.get('profiled') for item in stack):
+        profiler = cProfile.Profile()
+        frame['profiled'] = True
+
+    stack.append(frame)
+    record['timestamp'] = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record['wall_time_s'] = time.perf_counter() - wall_start
+        record['cpu_time_s'] = time.process_time() - cpu_start
+        stack.pop()
+
+        if _STATE.trace_memory and tracemalloc.is_tracing():
+            # the peak is reset by every nested stage, so the maximum over the segments is kept in the frame
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            record['peak_memory_bytes'] = max(peak - memory_start, 0)
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        else:
+            record['peak_memory_bytes'] = None
+
+        if profiler is not None:
+            file_name = f"{sequence:05d}_{name.replace('/', '_')}.prof"
+            record['profile_path'] = os.path.join(_STATE.profile_dir, file_name)
+            profiler.dump_stats(record['profile_path'])
+
+        __emit(record)
+
+
+def profiled(name: Optional[str] = None, rows_attr: Optional[str] = None) -> Callable:
+    """
+    Decorator recording a function call as a stage, see `stage`.
+
+    Input rows are the summed lengths of DataFrame arguments, output rows are taken from the return value.
+    When disabled, the wrapped function is called directly.
+
+    Args:
+        name (str or None): Name of the stage, defaults to the qualified name of the function.
+        rows_attr (str or None): Attribute of the first argument to count output rows from, for methods
+            that fill `self` instead of returning a result (e.g. 'entries').
+
+    Returns:
+        Callable: The decorator.
+    """
+    def decorator(func: Callable) -> Callable:
+        stage_name = name if name is not None else f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _STATE.enabled:
+                return func(*args, **kwargs)
+
+            with stage(stage_name, rows_in=__input_rows(args, kwargs)) as record:
+                result = func(*args, **kwargs)
+                if rows_attr is not None and args:
+                    record['rows_out'] = count_rows(getattr(args[0], rows_attr, None))
+                else:
+                    record['rows_out'] = count_rows(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+if os.environ.get('IMAGENET_PROFILE', '') not in ('', '0'):
+    enable(output=os.environ.get('IMAGENET_PROFILE_OUTPUT') or sys.stderr,
+           trace_memory=os.environ.get('IMAGENET_PROFILE_MEMORY', '1') != '0',
+           profile_dir=os.environ.get('IMAGENET_PROFILE_DIR'))
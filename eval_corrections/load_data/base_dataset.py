@@ -1,7 +1,11 @@
+from typing import Iterable, Set
+
 import numpy as np
 import pandas as pd
 import tensorflow_datasets as tfds
 
+from eval_corrections.instrumentation import profiled
+
 
 class Entry:
     def __init__(self, entry_id: str, original_label: int, proposed_labels: np.ndarray | None,
@@ -54,6 +58,7 @@ class Dataset:
         self.annotations = None
         self.entries = []
 
+    @profiled('dataset.load_annotations')
     def load_annotations(self) -> None:
         """
         Loads dataset annotations using TensorFlow Datasets.
@@ -64,6 +69,30 @@ class Dataset:
     def set_entries(self) -> None:
         pass
 
+    def mark_duplicates(self, duplicate_ids: Iterable[str]) -> int:
+        """
+        Sets the is_duplicate flag of all entries with the given identifiers.
+
+        :param duplicate_ids: Identifiers of duplicate images, e.g. the 'id' column of `find_duplicates`.
+        :return: Number of entries marked as duplicates.
+        """
+        duplicate_ids = set(duplicate_ids)
+        count = 0
+        for entry in self.entries:
+            if entry.id in duplicate_ids:
+                entry.is_duplicate = True
+                count += 1
+        return count
+
+    def get_duplicate_ids(self) -> Set[str]:
+        """
+        Collects identifiers of entries marked as duplicates.
+
+        :return: Set of identifiers of duplicate entries.
+        """
+        return {entry.id for entry in self.entries if entry.is_duplicate}
+
+    @profiled('dataset.entries_to_dataframe')
     def entries_to_dataframe(self) -> pd.DataFrame:
         """
         Converts the entries array into a Pandas DataFrame.
@@ -78,7 +107,8 @@ class Dataset:
                 'original_label': entry.original_label,
                 'proposed_labels': ', '.join(
                     map(str, entry.proposed_labels)) if entry.proposed_labels is not None else '',
-                'manually_validated': entry.is_manually_evaluated
+                'manually_validated': entry.is_manually_evaluated,
+                'is_duplicate': entry.is_duplicate,
             })
 
         return pd.DataFrame(data)
@@ -3,6 +3,7 @@ import os
 import numpy as np
 import pandas as pd
 
+from eval_corrections.instrumentation import profiled
 from eval_corrections.load_data.base_dataset import Entry, Dataset
 
 
@@ -52,6 +53,7 @@ class FinegrainedAnnotations(Dataset):
                                   file_path_annotation_contains = 'annotation_contains.pkl',
                                   file_path_annotation_classify = 'annotation_classify.pkl')
 
+    @profiled('finegrained.set_entries', rows_attr='entries')
     def set_entries_from_pkl(self, file_path_annotation_categories: str, file_path_annotation_contains: str,
                              file_path_annotation_classify: str) -> None:
         """
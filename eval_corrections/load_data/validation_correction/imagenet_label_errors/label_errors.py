@@ -1,11 +1,66 @@
 import json
 import os
+from typing import Iterator, TextIO
 
 import numpy as np
 import pandas as pd
 
+from eval_corrections.instrumentation import profiled
 from eval_corrections.load_data.base_dataset import Entry, Dataset
 
+MTURK_VOTES = ['given', 'guessed', 'neither', 'both']
+MTURK_COLUMNS = [f'mturk_{vote}' for vote in MTURK_VOTES]
+RECORD_DTYPE = np.dtype([('id', np.int32), ('original_label', np.int16), ('cl_label', np.int16)]
+                        + [(column, np.int8) for column in MTURK_COLUMNS])
+
+
+def iter_json_array(file: TextIO, chunk_size: int = 1 << 16) -> Iterator[dict]:
+    """
+    Incrementally parses the items of a top-level JSON array without loading the whole file.
+
+    :param file: Opened text file containing a JSON array.
+    :param chunk_size: Number of characters read at once.
+    :return: Iterator over the parsed items.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, started, at_eof = '', 0, False, False
+
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError("The file does not contain a JSON array.")
+                started = True
+                position += 1
+                continue
+
+            if buffer[position] == ']':
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                # a number cut off by the chunk boundary still decodes, so the item is accepted only once the
+                # separator following it has been read
+                delimiter = end
+                while delimiter < len(buffer) and buffer[delimiter] in ' \t\r\n':
+                    delimiter += 1
+                if (delimiter < len(buffer) and buffer[delimiter] in ',]') or at_eof:
+                    position = end
+                    yield item
+                    continue
+            except json.JSONDecodeError:
+                pass
+
+        if at_eof:
+            raise ValueError("Unexpected end of the JSON array.")
+
+        chunk = file.read(chunk_size)
+        at_eof = not chunk
+        buffer, position = buffer[position:] + chunk, 0
+
 
 class _ChildEntry(Entry):
     def __init__(self, entry_id: str, original_label: int, cl_label: int, url: str, mturk: dict):
@@ -48,6 +103,7 @@ class LabelErrors(Dataset):
     def set_entries(self) -> None:
         self.set_entries_from_json(file_path ='label_err_mturk.json')
 
+    @profiled('label_errors.set_entries', rows_attr='entries')
     def set_entries_from_json(self, file_path: str) -> None:
         """
         Load entries from a JSON file and set them as attributes of the instance.
@@ -67,6 +123,75 @@ class LabelErrors(Dataset):
             ]
         self.entries = np.array(self.entries)
 
+    @profiled('label_errors.set_records_stream', rows_attr='records')
+    def set_records_from_json_stream(self, file_path: str = 'label_err_mturk.json') -> None:
+        """
+        Streams records from a JSON file into a typed structured array, without building per-record objects.
+        Sets `records` with fields 'id', 'original_label', 'cl_label' and one int8 column per MTurk vote.
+        """
+        current_dir = os.path.dirname(__file__)
+
+        with open(os.path.join(current_dir, file_path), 'r') as file:
+            self.records = np.fromiter(
+                ((int(record['id']), int(record['given_original_label']), int(record['our_guessed_label']))
+                 + tuple(int(record['mturk'][vote]) for vote in MTURK_VOTES)
+                 for record in iter_json_array(file)),
+                dtype=RECORD_DTYPE
+            )
+
+    @profiled('label_errors.records_to_dataframe')
+    def records_to_dataframe(self, majority_count: int = 3) -> pd.DataFrame:
+        """
+        Converts the streamed records into a Pandas DataFrame with votes as flat numeric columns.
+        Categories and proposed labels are determined as in _ChildEntry, vectorized over all records.
+
+        :param majority_count: Number of votes needed for a decision.
+        :return: DataFrame with the columns of `entries_to_dataframe`, the mturk dict replaced by mturk_* columns.
+        """
+        records = self.records
+        original_label = pd.Series(records['original_label']).astype(str)
+        cl_label = pd.Series(records['cl_label']).astype(str)
+
+        decisions = [records[f'mturk_{vote}'] >= majority_count for vote in ['given', 'guessed', 'both', 'neither']]
+        category = np.select(decisions, ['A', 'B', 'M', 'Z'], default='X')
+        proposed_labels = np.select(decisions[:3], [original_label, cl_label, original_label + ', ' + cl_label],
+                                    default='')
+
+        df = pd.DataFrame({
+            'id': 'ILSVRC2012_val_' + pd.Series(records['id']).astype(str).str.zfill(8) + '.JPEG',
+            'category': category,
+            'original_label': records['original_label'].astype(np.int64),
+            'proposed_labels': proposed_labels,
+            'manually_validated': True,
+            'is_duplicate': False,
+            'cl_label': records['cl_label'].astype(np.int64),
+        })
+        for column in MTURK_COLUMNS:
+            df[column] = records[column]
+
+        return df
+
+    def export_flat_csv(self, file_path: str) -> None:
+        """
+        Saves the streamed records as a CSV file with votes as flat numeric columns, see `read_flat_csv`.
+
+        :param file_path: Path of the output CSV file.
+        """
+        self.records_to_dataframe().to_csv(file_path, index=False)
+
+    @staticmethod
+    def read_flat_csv(file_path: str) -> pd.DataFrame:
+        """
+        Loads a CSV file written by `export_flat_csv` with compact numeric dtypes, without per-row parsing.
+
+        :param file_path: Path of the CSV file.
+        :return: DataFrame as returned by `records_to_dataframe`.
+        """
+        dtypes = {'original_label': np.int64, 'cl_label': np.int64, 'manually_validated': bool,
+                  'proposed_labels': str, **{column: np.int8 for column in MTURK_COLUMNS}}
+        return pd.read_csv(file_path, dtype=dtypes, keep_default_na=False)
+
+    @profiled('label_errors.entries_to_dataframe')
     def entries_to_dataframe(self) -> pd.DataFrame:
         """
         Converts the entries array into a Pandas DataFrame including additional annotation_type.
@@ -82,6 +207,7 @@ class LabelErrors(Dataset):
                 'proposed_labels': ', '.join(map(str, entry.proposed_labels.tolist()))
                 if entry.proposed_labels is not None else '',
                 'manually_validated': entry.is_manually_evaluated,
+                'is_duplicate': entry.is_duplicate,
                 'cl_label': str(entry.cl_label),
                 'mturk': entry.mturk,
             })
@@ -3,6 +3,7 @@ import re
 import numpy as np
 import pandas as pd
 
+from eval_corrections.instrumentation import profiled
 from eval_corrections.load_data.base_dataset import Entry, Dataset
 
 
@@ -35,6 +36,7 @@ class Multilabel(Dataset):
         """
         super().__init__(dataset_name='imagenet2012_multilabel', split=split)
 
+    @profiled('multilabel.set_entries', rows_attr='entries')
     def set_entries(self) -> None:
         """
         Processes annotations and sets _ChildEntry instances as numpy arrays.
@@ -57,6 +59,7 @@ class Multilabel(Dataset):
             self.entries.append(entry)
         self.entries = np.array(self.entries)
 
+    @profiled('multilabel.entries_to_dataframe')
     def entries_to_dataframe(self) -> pd.DataFrame:
         """
         Converts the entries array into a Pandas DataFrame including additional annotation_type.
@@ -72,6 +75,7 @@ class Multilabel(Dataset):
                 'proposed_labels': ', '.join(
                     map(str, entry.proposed_labels)) if entry.proposed_labels is not None else '',
                 'manually_validated': entry.is_manually_evaluated,
+                'is_duplicate': entry.is_duplicate,
                 'unclear_multi_labels': ', '.join(
                     map(str, entry.unclear_multi_labels)) if entry.unclear_multi_labels is not None else '',
                 'wrong_multi_labels': ', '.join(
@@ -3,6 +3,7 @@ import re
 
 import numpy as np
 
+from eval_corrections.instrumentation import profiled
 from eval_corrections.load_data.base_dataset import Entry, Dataset
 
 
@@ -30,6 +31,7 @@ class Real(Dataset):
         """
         super().__init__(dataset_name='imagenet2012_real', split=split)
 
+    @profiled('real.set_entries', rows_attr='entries')
     def set_entries(self, manual_ids_filename: str = 'manual_real_imgs.npy') -> None:
         """
         Processes annotations and sets entries as numpy arrays.
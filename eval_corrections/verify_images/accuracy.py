@@ -0,0 +1,274 @@
+import os
+
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Optional, Union
+
+from eval_corrections.verify_images.utils import CLEAN_CATEGORIES, NUM_CLASSES, NUM_VAL_IMAGES, parse_image_ids
+
+CATEGORIES = CLEAN_CATEGORIES
+
+CLEAN_VALIDATION_PATH = os.path.join(os.path.dirname(__file__), 'results', 'clean_validation.csv')
+
+_FIELDS = (['original_count', 'original_top1', 'original_topk',
+            'clean_count', 'clean_top1', 'clean_topk', 'multilabel_hits', 'multilabel_total']
+           + [f'{category}_{counter}' for category in CLEAN_CATEGORIES
+              for counter in ['count', 'top1', 'topk', 'original_top1']])
+_FIELD_INDEX = {field: idx for idx, field in enumerate(_FIELDS)}
+
+
+class CleanLabelIndex:
+    """
+    Dense index from validation image numbers to their clean label sets.
+
+    Attributes:
+        original_label: Original label per image number, -1 if unknown.
+        category: Index into `CLEAN_CATEGORIES` per image number, -1 if the image is not in the clean set.
+        label_bits: Packed bitset (images x 125 bytes) of the clean labels of every image.
+        num_labels: Number of clean labels of every image.
+    """
+    def __init__(self, df: pd.DataFrame):
+        """
+        Builds the index from a clean validation DataFrame.
+
+        Args:
+            df (pd.DataFrame): DataFrame with columns 'id', 'original_label' and 'proposed_labels' (comma
+                separated), e.g. `results/clean_validation.csv`.
+        """
+        numbers = parse_image_ids(df['id'].to_numpy(dtype=str))
+        if len(numbers) and (numbers.min() < 1 or numbers.max() > NUM_VAL_IMAGES):
+            raise ValueError("Image numbers are out of the validation range.")
+
+        size = NUM_VAL_IMAGES + 1
+        self.original_label = np.full(size, -1, dtype=np.int16)
+        self.category = np.full(size, -1, dtype=np.int8)
+        self.label_bits = np.zeros((size, (NUM_CLASSES + 7) // 8), dtype=np.uint8)
+        self.num_labels = np.zeros(size, dtype=np.uint8)
+
+        labels = df['proposed_labels'].fillna('').astype(str).str.split(',')
+        labels = labels.apply(lambda row: [int(label) for label in row if label.strip()])
+        lengths = labels.str.len().to_numpy()
+        flat_labels = np.array([label for row in labels for label in row], dtype=np.int64)
+        flat_numbers = np.repeat(numbers, lengths)
+
+        self.original_label[numbers] = df['original_label'].to_numpy()
+        np.bitwise_or.at(self.label_bits, (flat_numbers, flat_labels >> 3),
+                         np.left_shift(1, flat_labels & 7).astype(np.uint8))
+        self.num_labels[numbers] = lengths
+
+        single = lengths == 1
+        same = single & (self.label_bits[numbers, self.original_label[numbers] >> 3]
+                         >> (self.original_label[numbers] & 7) & 1).astype(bool)
+        # images without any clean label (e.g. Z or X rows) stay outside the clean set
+        self.category[numbers] = np.where(lengths == 0, -1, np.where(same, 0, np.where(single, 1, 2)))
+
+    @classmethod
+    def from_csv(cls, file_path: str = CLEAN_VALIDATION_PATH) -> 'CleanLabelIndex':
+        """
+        Builds the index from a clean validation CSV file.
+
+        Args:
+            file_path (str): Path to the CSV file, defaults to `results/clean_validation.csv`.
+
+        Returns:
+            CleanLabelIndex: The index.
+        """
+        return cls(pd.read_csv(file_path))
+
+    def contains(self, numbers: np.ndarray, labels: np.ndarray) -> np.ndarray:
+        """
+        Checks which labels are in the clean label sets of the images.
+
+        Args:
+            numbers (np.ndarray): Image numbers, broadcastable against labels.
+            labels (np.ndarray): Predicted labels.
+
+        Returns:
+            np.ndarray: Boolean array in the shape of labels.
+        """
+        return (self.label_bits[numbers, labels >> 3] >> (labels & 7) & 1).astype(bool)
+
+
+class CleanAccuracyAccumulator:
+    """
+    Streaming, mergeable accuracy counters on the original and clean validation labels.
+
+    Each data-parallel worker updates its own accumulator per batch; the states are then summed, either with
+    `merge`, or by all-reducing `state` (a flat int64 vector) with the distributed backend.
+
+    Counters:
+        original: Top-1 and top-k accuracy on the original labels, for every image with a known original label.
+        clean: Top-1 and top-k accuracy on the clean label sets, for images in the clean set.
+        multilabel: Share of the clean labels found in the top-k, normalised by min(k, number of clean labels).
+        A/B/M: Clean top-1, top-k and original top-1 accuracy per category.
+
+    Attributes:
+        index: The clean label index.
+        topk: Number of predictions per image used for the top-k counters.
+        state: Flat int64 vector of all counters.
+    """
+    def __init__(self, index: CleanLabelIndex, topk: int = 5):
+        """
+        Initializes an empty accumulator.
+
+        Args:
+            index (CleanLabelIndex): The clean label index.
+            topk (int): Number of predictions per image used for the top-k counters.
+        """
+        self.index = index
+        self.topk = topk
+        self.state = np.zeros(len(_FIELDS), dtype=np.int64)
+
+    def update(self, image_ids: Union[Iterable[str], Iterable[int], np.ndarray], topk_preds: np.ndarray,
+               original_labels: Optional[np.ndarray] = None) -> None:
+        """
+        Adds a batch of predictions to the counters.
+
+        Args:
+            image_ids: File names or image numbers of the batch.
+            topk_preds (np.ndarray): Array (batch x k) of predicted labels, sorted by decreasing score, with k at
+                least `topk`; extra columns are ignored.
+            original_labels (np.ndarray or None): Original labels of the batch, needed to count images outside
+                the clean set in the original accuracy.
+        """
+        numbers = parse_image_ids(image_ids)
+        preds = np.asarray(topk_preds, dtype=np.int64)
+        if preds.ndim != 2 or preds.shape[1] < self.topk:
+            raise ValueError(f"Expected predictions of shape (batch, >= {self.topk}), got {preds.shape}.")
+        preds = preds[:, :self.topk]
+
+        if original_labels is None:
+            original = self.index.original_label[numbers].astype(np.int64)
+        else:
+            original = np.asarray(original_labels, dtype=np.int64)
+
+        known = original >= 0
+        original_hits = preds[known] == original[known, None]
+        self.__add('original_count', known.sum())
+        self.__add('original_top1', original_hits[:, 0].sum())
+        self.__add('original_topk', original_hits.any(axis=1).sum())
+
+        category = self.index.category[numbers]
+        clean = category >= 0
+        clean_numbers, clean_preds = numbers[clean], preds[clean]
+        hits = self.index.contains(clean_numbers[:, None], clean_preds)
+        top1, topk = hits[:, 0], hits.any(axis=1)
+
+        self.__add('clean_count', clean.sum())
+        self.__add('clean_top1', top1.sum())
+        self.__add('clean_topk', topk.sum())
+        self.__add('multilabel_hits', hits.sum())
+        self.__add('multilabel_total', np.minimum(self.index.num_labels[clean_numbers], preds.shape[1]).sum())
+
+        original_top1 = clean_preds[:, 0] == original[clean]
+        clean_category = category[clean]
+        for idx, name in enumerate(CLEAN_CATEGORIES):
+            in_category = clean_category == idx
+            self.__add(f'{name}_count', in_category.sum())
+            self.__add(f'{name}_top1', top1[in_category].sum())
+            self.__add(f'{name}_topk', topk[in_category].sum())
+            self.__add(f'{name}_original_top1', original_top1[in_category].sum())
+
+    def __add(self, field: str, value: int) -> None:
+        """
+        Increments a counter by name.
+        """
+        self.state[_FIELD_INDEX[field]] += int(value)
+
+    def merge(self, other: 'CleanAccuracyAccumulator') -> 'CleanAccuracyAccumulator':
+        """
+        Adds the counters of another accumulator, e.g. of another worker.
+
+        Args:
+            other (CleanAccuracyAccumulator): The accumulator to merge.
+
+        Returns:
+            CleanAccuracyAccumulator: This accumulator.
+        """
+        if other.topk != self.topk:
+            raise ValueError("Accumulators with different top-k cannot be merged.")
+
+        self.state += other.state
+        return self
+
+    @classmethod
+    def reduce(cls, accumulators: List['CleanAccuracyAccumulator']) -> 'CleanAccuracyAccumulator':
+        """
+        Sums the counters of several accumulators into a new one.
+
+        Args:
+            accumulators (List[CleanAccuracyAccumulator]): The accumulators, sharing one index.
+
+        Returns:
+            CleanAccuracyAccumulator: The reduced accumulator.
+        """
+        if not accumulators:
+            raise ValueError("The list of accumulators is empty.")
+
+        reduced = cls(accumulators[0].index, accumulators[0].topk)
+        for accumulator in accumulators:
+            reduced.merge(accumulator)
+        return reduced
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: All raw counters by name.
+        """
+        return {field: int(value) for field, value in zip(_FIELDS, self.state)}
+
+    def results(self) -> Dict[str, float]:
+        """
+        Computes the accuracies from the counters.
+
+        Returns:
+            Dict[str, float]: Accuracies in percent, NaN where no image was counted.
+        """
+        counts = self.counts()
+        k = self.topk
+
+        def ratio(hits: str, total: str) -> float:
+            return 100 * counts[hits] / counts[total] if counts[total] else float('nan')
+
+        results = {
+            'original_top1': ratio('original_top1', 'original_count'),
+            f'original_top{k}': ratio('original_topk', 'original_count'),
+            'clean_top1': ratio('clean_top1', 'clean_count'),
+            f'clean_top{k}': ratio('clean_topk', 'clean_count'),
+            'multilabel': ratio('multilabel_hits', 'multilabel_total'),
+        }
+        for name in CLEAN_CATEGORIES:
+            results[f'{name}_top1'] = ratio(f'{name}_top1', f'{name}_count')
+            results[f'{name}_top{k}'] = ratio(f'{name}_topk', f'{name}_count')
+            results[f'{name}_original_top1'] = ratio(f'{name}_original_top1', f'{name}_count')
+
+        return results
+
+    def save(self, file_path: str) -> None:
+        """
+        Saves the counters into an .npz file, see `load`.
+
+        Args:
+            file_path (str): Path of the output file.
+        """
+        np.savez(file_path, state=self.state, topk=self.topk, fields=np.array(_FIELDS))
+
+    @classmethod
+    def load(cls, file_path: str, index: CleanLabelIndex) -> 'CleanAccuracyAccumulator':
+        """
+        Loads counters saved by `save`.
+
+        Args:
+            file_path (str): Path of the .npz file.
+            index (CleanLabelIndex): The clean label index.
+
+        Returns:
+            CleanAccuracyAccumulator: The loaded accumulator.
+        """
+        data = np.load(file_path)
+        if data['fields'].tolist() != _FIELDS:
+            raise ValueError("The saved counters do not match the accumulator layout.")
+
+        accumulator = cls(index, int(data['topk']))
+        accumulator.state = data['state'].astype(np.int64)
+        return accumulator
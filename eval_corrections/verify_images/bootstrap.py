@@ -0,0 +1,265 @@
+import itertools
+import math
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Set, Tuple
+
+from eval_corrections.instrumentation import profiled
+from eval_corrections.verify_images.accuracy import CleanLabelIndex
+from eval_corrections.verify_images.utils import (CLEAN_CATEGORIES, PROBLEM_GROUPS_PATH, load_problem_groups,
+                                                  parse_image_ids)
+
+METHODS = ('poisson', 'index')
+
+# P(X <= k) of Poisson(1) for k = 0..9, the remaining mass of 1e-8 is cut off at 10
+_POISSON_CDF = np.cumsum([np.exp(-1) / math.factorial(k) for k in range(10)]).astype(np.float32)
+_POISSON_BLOCKS = 8
+
+
+def problem_group_masks(labels: np.ndarray, groups: List[Set[int]]) -> Dict[str, np.ndarray]:
+    """
+    Assign images to problem groups by their label.
+
+    Args:
+        labels (np.ndarray): Label of every image, e.g. the original label.
+        groups (List[Set[int]]): Classes of every group, see `load_problem_groups`.
+
+    Returns:
+        Dict[str, np.ndarray]: Boolean image mask of every non-empty group, keyed 'group_<position>'.
+    """
+    labels = np.asarray(labels)
+    masks = {}
+    for idx, group in enumerate(groups):
+        mask = np.isin(labels, list(group))
+        if mask.any():
+            masks[f'group_{idx}'] = mask
+    return masks
+
+
+def clean_top1_correct(index: CleanLabelIndex, image_ids, topk_preds: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-image correctness of top-1 predictions on the clean labels.
+
+    Args:
+        index (CleanLabelIndex): The clean label index.
+        image_ids: File names or image numbers of the predictions.
+        topk_preds (np.ndarray): Array (images x k) of predicted labels, sorted by decreasing score.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Correctness of every image in the clean set, and the category
+        ('A', 'B' or 'M') of those images.
+    """
+    numbers = parse_image_ids(image_ids)
+    preds = np.asarray(topk_preds, dtype=np.int64).reshape(len(numbers), -1)
+
+    clean = index.category[numbers] >= 0
+    correct = index.contains(numbers[clean], preds[clean, 0])
+
+    return correct, CLEAN_CATEGORIES[index.category[numbers[clean]]]
+
+
+def __poisson_weights(rng: np.random.Generator, num_resamples: int, num_images: int) -> np.ndarray:
+    """
+    Draws Poisson(1) weights by counting the CDF thresholds below uniform numbers.
+
+    The uniforms and counts are drawn in blocks of rows, so the temporaries stay below a fifth of the float32 weight
+    matrix; `rng.poisson` would first allocate an int64 matrix twice its size.
+
+    Returns:
+        np.ndarray: Weights (resamples x images) as float32.
+    """
+    weights = np.empty((num_resamples, num_images), dtype=np.float32)
+    block = -(-num_resamples // _POISSON_BLOCKS)
+    for start in range(0, num_resamples, block):
+        uniform = rng.random((min(block, num_resamples - start), num_images), dtype=np.float32)
+        counts = np.zeros(uniform.shape, dtype=np.uint8)
+        for threshold in _POISSON_CDF:
+            counts += uniform >= threshold
+        weights[start:start + len(counts)] = counts
+    return weights
+
+
+def __bootstrap_chunk(args: Tuple[np.ndarray, np.ndarray, int, str, np.random.SeedSequence]) -> np.ndarray:
+    """
+    Pool worker computing accuracies of one chunk of resamples.
+
+    Returns:
+        np.ndarray: Accuracies (subsets x models x resamples of the chunk).
+    """
+    correct, masks, num_resamples, method, seed = args
+    rng = np.random.default_rng(seed)
+    num_models, num_images = correct.shape
+
+    if method == 'poisson':
+        # the weights of a subset's images are a Poisson bootstrap of the subset, so all subsets share one matrix
+        weights = __poisson_weights(rng, num_resamples, num_images)
+        hits = ((masks[:, None, :] & correct[None]).reshape(-1, num_images).astype(np.float32) @ weights.T)
+        totals = (masks.astype(np.float32) @ weights.T)[:, None, :]
+        # a resample giving a subset no weight at all has no accuracy, 0 would bias small subsets
+        accuracies = np.full((len(masks), num_models, num_resamples), np.nan)
+        np.divide(hits.reshape(accuracies.shape), totals, out=accuracies, where=totals > 0)
+        return accuracies
+
+    accuracies = np.empty((len(masks), num_models, num_resamples))
+    for subset_idx, mask in enumerate(masks):
+        subset = correct[:, mask].astype(np.float32)
+        indices = rng.integers(0, subset.shape[1], size=(num_resamples, subset.shape[1]))
+        accuracies[subset_idx] = subset[:, indices].mean(axis=2)
+    return accuracies
+
+
+@profiled('bootstrap.resample')
+def bootstrap_subset_accuracy(correct: np.ndarray, masks: np.ndarray, num_resamples: int = 10000,
+                              method: str = 'poisson', max_chunk_bytes: int = 1 << 28, processes: int = 1,
+                              seed: int = 0) -> np.ndarray:
+    """
+    Bootstrap the accuracy of one or more models on several subsets of the same images.
+
+    All models share the resamples, so differences of the returned accuracies are paired. With Poisson weights, all
+    subsets also share one weight matrix: 10000 resamples of 36k images and 3 models take about 10 s in one
+    process, nearly all of it drawing the weights. With 'index', every subset is resampled on its own, which is
+    several times slower.
+
+    Resamples are drawn in chunks whose weight matrix (5 bytes per weight, including the temporaries) or index and
+    gathered correctness matrices stay below `max_chunk_bytes`. Chunks get independent seeds spawned from `seed`,
+    so the result does not depend on the number of processes.
+
+    Args:
+        correct (np.ndarray): Boolean correctness (models x images), or a vector for a single model.
+        masks (np.ndarray): Boolean non-empty subset masks (subsets x images).
+        num_resamples (int): Number of bootstrap resamples.
+        method (str): 'poisson' for Poisson(1) weights, 'index' for resampling with replacement.
+        max_chunk_bytes (int): Memory bound of one chunk of resamples.
+        processes (int): Number of worker processes, 1 computes the chunks in this process.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        np.ndarray: Bootstrapped accuracies (subsets x models x resamples). With Poisson weights, resamples giving a
+        subset a total weight of 0 are NaN, which happens with probability exp(-size of the subset).
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method: {method}, expected one of {METHODS}.")
+
+    correct = np.atleast_2d(np.asarray(correct, dtype=bool))
+    masks = np.atleast_2d(np.asarray(masks, dtype=bool))
+    num_models, num_images = correct.shape
+    if num_images == 0:
+        raise ValueError("The correctness vectors are empty.")
+    if masks.shape[1] != num_images or not masks.any(axis=1).all():
+        raise ValueError("Every subset mask must select images of the correctness vectors.")
+
+    bytes_per_resample = num_images * (5 if method == 'poisson' else 8 + 4 * num_models)
+    chunk_size = int(max(1, min(num_resamples, max_chunk_bytes // bytes_per_resample)))
+    chunk_sizes = [min(chunk_size, num_resamples - start) for start in range(0, num_resamples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    tasks = [(correct, masks, size, method, chunk_seed) for size, chunk_seed in zip(chunk_sizes, seeds)]
+
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            chunks = pool.map(__bootstrap_chunk, tasks)
+    else:
+        chunks = [__bootstrap_chunk(task) for task in tasks]
+
+    return np.concatenate(chunks, axis=2)
+
+
+def bootstrap_accuracy(correct: np.ndarray, num_resamples: int = 10000, method: str = 'poisson',
+                       max_chunk_bytes: int = 1 << 28, processes: int = 1, seed: int = 0) -> np.ndarray:
+    """
+    Bootstrap the accuracy of one or more models on the same images, see `bootstrap_subset_accuracy`.
+
+    Args:
+        correct (np.ndarray): Boolean correctness (models x images), or a vector for a single model.
+        num_resamples (int): Number of bootstrap resamples.
+        method (str): 'poisson' for Poisson(1) weights, 'index' for resampling with replacement.
+        max_chunk_bytes (int): Memory bound of one chunk of resamples.
+        processes (int): Number of worker processes, 1 computes the chunks in this process.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        np.ndarray: Bootstrapped accuracies (models x resamples), NaN for Poisson resamples of total weight 0.
+    """
+    correct = np.atleast_2d(np.asarray(correct, dtype=bool))
+    masks = np.ones((1, correct.shape[1]), dtype=bool)
+    return bootstrap_subset_accuracy(correct, masks, num_resamples=num_resamples, method=method,
+                                     max_chunk_bytes=max_chunk_bytes, processes=processes, seed=seed)[0]
+
+
+def __percentile_interval(values: np.ndarray, confidence: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Lower and upper percentile bounds along the last axis, ignoring NaN.
+    """
+    alpha = 1 - confidence
+    low, high = np.nanquantile(values, [alpha / 2, 1 - alpha / 2], axis=-1)
+    return low, high
+
+
+@profiled('bootstrap.report')
+def bootstrap_report(correct: np.ndarray, model_names: List[str], categories: Optional[np.ndarray] = None,
+                     groups: Optional[Dict[str, np.ndarray]] = None, num_resamples: int = 10000,
+                     confidence: float = 0.95, method: str = 'poisson', max_chunk_bytes: int = 1 << 28,
+                     processes: int = 1, seed: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Bootstrap confidence intervals of accuracies and paired p-values of accuracy differences.
+
+    Subsets are all images, every category and every problem group. See `bootstrap_subset_accuracy` for the cost;
+    the default of 10000 Poisson resamples takes about 10 s for 36k images.
+
+    Args:
+        correct (np.ndarray): Boolean correctness (models x images).
+        model_names (List[str]): Names of the models.
+        categories (np.ndarray or None): Category of every image, e.g. from `clean_top1_correct`.
+        groups (Dict[str, np.ndarray] or None): Boolean image masks, e.g. from `problem_group_masks`.
+        num_resamples (int): Number of bootstrap resamples.
+        confidence (float): Confidence level of the intervals.
+        method (str): 'poisson' or 'index', see `bootstrap_subset_accuracy`.
+        max_chunk_bytes (int): Memory bound of one chunk of resamples.
+        processes (int): Number of worker processes.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: Intervals per subset and model, and paired differences per subset and
+        pair of models with two-sided bootstrap p-values.
+    """
+    correct = np.atleast_2d(np.asarray(correct, dtype=bool))
+    if len(model_names) != correct.shape[0]:
+        raise ValueError("The number of model names does not match the number of correctness vectors.")
+
+    subsets = {'all': np.ones(correct.shape[1], dtype=bool)}
+    if categories is not None:
+        categories = np.asarray(categories)
+        for category in CLEAN_CATEGORIES:
+            subsets[category] = categories == category
+    if groups is not None:
+        subsets.update(groups)
+
+    subsets = {subset: mask for subset, mask in subsets.items() if mask.any()}
+    subset_accuracies = bootstrap_subset_accuracy(correct, np.array(list(subsets.values())),
+                                                  num_resamples=num_resamples, method=method,
+                                                  max_chunk_bytes=max_chunk_bytes, processes=processes, seed=seed)
+
+    intervals, differences = [], []
+    for (subset, mask), accuracies in zip(subsets.items(), subset_accuracies):
+        observed = correct[:, mask].mean(axis=1)
+        low, high = __percentile_interval(accuracies, confidence)
+
+        for model_idx, model in enumerate(model_names):
+            intervals.append({'subset': subset, 'model': model, 'num_images': int(mask.sum()),
+                              'accuracy': 100 * observed[model_idx], 'ci_low': 100 * low[model_idx],
+                              'ci_high': 100 * high[model_idx]})
+
+        for a, b in itertools.combinations(range(len(model_names)), 2):
+            difference = accuracies[a] - accuracies[b]
+            diff_low, diff_high = __percentile_interval(difference, confidence)
+            # NaN resamples (subset without weight) compare False on both sides and are left out of the count
+            num_valid = int((~np.isnan(difference)).sum())
+            tail = min((difference <= 0).sum(), (difference >= 0).sum())
+            differences.append({'subset': subset, 'model_a': model_names[a], 'model_b': model_names[b],
+                                'difference': 100 * (observed[a] - observed[b]), 'ci_low': 100 * diff_low,
+                                'ci_high': 100 * diff_high,
+                                'p_value': min(1.0, 2 * (tail + 1) / (num_valid + 1))})
+
+    return pd.DataFrame(intervals), pd.DataFrame(differences)
@@ -2,7 +2,10 @@ import itertools
 import pandas as pd
 from typing import List, Tuple, Union
 
+from eval_corrections.instrumentation import profiled
 
+
+@profiled('df_utils.filter_by_categories')
 def filter_by_categories(df: pd.DataFrame, categories: List[str]) -> pd.DataFrame:
     """
     Filter the DataFrame to include only rows with specified categories.
@@ -17,6 +20,7 @@ def filter_by_categories(df: pd.DataFrame, categories: List[str]) -> pd.DataFram
     return df[df['category'].isin(categories)]
 
 
+@profiled('df_utils.filter_inconsistent_cats')
 def filter_inconsistent_cats(df: pd.DataFrame) -> pd.DataFrame:
     """
     Filters a DataFrame to remove inconsistent category data and sets validation types.
@@ -30,6 +34,7 @@ def filter_inconsistent_cats(df: pd.DataFrame) -> pd.DataFrame:
     return set_validation_type(__filter_inconsistent_rows(df.copy(), pattern='category'))
 
 
+@profiled('df_utils.filter_inconsistent_labels')
 def filter_inconsistent_labels(df: pd.DataFrame) -> pd.DataFrame:
     """
     Filter out rows where columns matching the pattern have inconsistent values and consolidate them.
@@ -61,6 +66,7 @@ def __filter_inconsistent_rows(df: pd.DataFrame, pattern: str) -> pd.DataFrame:
     return df
 
 
+@profiled('df_utils.remove_duplicate_cols')
 def __remove_duplicate_cols(df: pd.DataFrame, pattern: str) -> pd.DataFrame:
     """
     Remove duplicate columns starting with 'original_label' and consolidate them into a single column.
@@ -104,6 +110,7 @@ def __check_values(row):
             return -1
 
 
+@profiled('df_utils.intersect_and_combine')
 def intersect_and_combine(dfs: List[pd.DataFrame], columns: List[str],
                           rows_to_omit: Union[List, None] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
@@ -146,6 +153,7 @@ def intersect_and_combine(dfs: List[pd.DataFrame], columns: List[str],
     return combined_df, intersections
 
 
+@profiled('df_utils.combine_dataframes')
 def __combine_dataframes(dfs: List[pd.DataFrame], combined_df: pd.DataFrame,
                          combine_columns: List[str]) -> pd.DataFrame:
     """
@@ -169,6 +177,7 @@ def __combine_dataframes(dfs: List[pd.DataFrame], combined_df: pd.DataFrame,
     return combined_result
 
 
+@profiled('df_utils.find_all_intersections')
 def find_all_intersections(dfs: List[pd.DataFrame], combination_length: int, columns: List[str],
                            prev_intersections: Union[pd.DataFrame, None] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
@@ -210,6 +219,7 @@ def __get_combinations(dfs: List[pd.DataFrame], combination_length: int) -> List
     return list(itertools.combinations(dfs, combination_length))
 
 
+@profiled('df_utils.set_validation_type')
 def set_validation_type(df: pd.DataFrame, new_col_name: str = 'validation') -> pd.DataFrame:
     """
     Add a new column to the DataFrame based on the values in each row for columns matching the pattern.
@@ -0,0 +1,438 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+from typing import Any, Iterable, List, Optional, Tuple
+
+from eval_corrections.instrumentation import profiled, stage
+from eval_corrections.verify_images.utils import POPCOUNT, VALIDATION_PREFIX, is_validation_id
+
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.png')
+
+_HASH_SIZE = 8
+_IMAGE_SIZE = 32
+_HASH_BITS = _HASH_SIZE * _HASH_SIZE
+
+_DCT = np.sqrt(2 / _IMAGE_SIZE) * np.cos(
+    np.pi * np.outer(np.arange(_IMAGE_SIZE), 2 * np.arange(_IMAGE_SIZE) + 1) / (2 * _IMAGE_SIZE))
+_DCT[0] /= np.sqrt(2)
+_DCT = _DCT.astype(np.float32)
+
+
+def compute_phash(path: str) -> Optional[int]:
+    """
+    Compute the DCT perceptual hash of an image.
+
+    The JPEG decoder is asked for a reduced-size grayscale draft, so large images are never fully decoded.
+
+    Args:
+        path (str): Path to the image.
+
+    Returns:
+        int or None: The 64-bit hash, None if the image cannot be read.
+    """
+    try:
+        with Image.open(path) as image:
+            image.draft('L', (2 * _IMAGE_SIZE, 2 * _IMAGE_SIZE))
+            pixels = np.asarray(image.convert('L').resize((_IMAGE_SIZE, _IMAGE_SIZE), Image.BILINEAR),
+                                dtype=np.float32)
+    except OSError:
+        return None
+
+    coefficients = (_DCT @ pixels @ _DCT.T)[:_HASH_SIZE, :_HASH_SIZE].ravel()
+    bits = coefficients > np.median(coefficients[1:])
+
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming_distance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Element-wise Hamming distance of two arrays of 64-bit hashes.
+
+    Args:
+        a (np.ndarray): First array of uint64 hashes.
+        b (np.ndarray): Second array of uint64 hashes.
+
+    Returns:
+        np.ndarray: The distances as uint8.
+    """
+    xor = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    return POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+def scan_images(root: str) -> pd.DataFrame:
+    """
+    List all images below a directory.
+
+    Args:
+        root (str): The image directory, e.g. containing the ImageNet 'train' and 'val' folders.
+
+    Returns:
+        pd.DataFrame: Columns 'path' (relative to root), 'mtime_ns' and 'size'.
+    """
+    paths, mtimes, sizes = [], [], []
+    for directory, _, file_names in os.walk(root):
+        for file_name in file_names:
+            if not file_name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            stat = os.stat(os.path.join(directory, file_name))
+            paths.append(os.path.relpath(os.path.join(directory, file_name), root))
+            mtimes.append(stat.st_mtime_ns)
+            sizes.append(stat.st_size)
+
+    return pd.DataFrame({'path': paths, 'mtime_ns': np.array(mtimes, dtype=np.int64),
+                         'size': np.array(sizes, dtype=np.int64)})
+
+
+def __encode_paths(paths: np.ndarray) -> np.ndarray:
+    """
+    Pack paths into one NUL-separated UTF-8 byte array, a fraction of the size of a fixed-width unicode array.
+    """
+    return np.frombuffer('\0'.join(paths).encode('utf-8'), dtype=np.uint8)
+
+
+def __decode_paths(data: np.ndarray) -> List[str]:
+    """
+    Unpack paths packed by `__encode_paths`.
+    """
+    return data.tobytes().decode('utf-8').split('\0') if len(data) else []
+
+
+def __part_paths(cache_path: str) -> List[str]:
+    """
+    Returns:
+        List[str]: The part files of the cache written by periodic saves, in write order.
+    """
+    directory, prefix = os.path.split(os.path.abspath(cache_path + '.part'))
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.startswith(prefix) and name.endswith('.npz'))
+
+
+def __write_cache_file(path: str, images: pd.DataFrame, hashes: np.ndarray, rows: np.ndarray) -> None:
+    """
+    Atomically write the given rows of the scanned images and their hashes into an .npz file.
+    """
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        np.savez(file, paths=__encode_paths(images['path'].to_numpy(dtype=str)[rows]),
+                 mtime_ns=images['mtime_ns'].to_numpy()[rows], size=images['size'].to_numpy()[rows],
+                 hash=hashes[rows])
+    os.replace(temporary_path, path)
+
+
+def __load_cache(cache_path: Optional[str]) -> pd.DataFrame:
+    """
+    Load the hash cache written by `compute_hashes`, including the parts left by an interrupted run.
+
+    Args:
+        cache_path (str or None): Path to the .npz cache.
+
+    Returns:
+        pd.DataFrame: Columns 'path', 'mtime_ns', 'size' and 'hash', empty if there is no cache.
+    """
+    frames = [pd.DataFrame({'path': pd.Series(dtype=str), 'mtime_ns': pd.Series(dtype=np.int64),
+                            'size': pd.Series(dtype=np.int64), 'hash': pd.Series(dtype=np.uint64)})]
+    if cache_path is None:
+        return frames[0]
+
+    files = ([cache_path] if os.path.exists(cache_path) else []) + __part_paths(cache_path)
+    for file_path in files:
+        data = np.load(file_path)
+        frames.append(pd.DataFrame({'path': __decode_paths(data['paths']), 'mtime_ns': data['mtime_ns'],
+                                    'size': data['size'], 'hash': data['hash']}))
+
+    return pd.concat(frames, ignore_index=True).drop_duplicates('path', keep='last').reset_index(drop=True)
+
+
+def __save_cache(cache_path: str, images: pd.DataFrame, hashes: np.ndarray, valid: np.ndarray) -> None:
+    """
+    Atomically write the hashes of all valid images into the .npz cache and remove the parts of periodic saves.
+
+    Args:
+        cache_path (str): Path to the .npz cache.
+        images (pd.DataFrame): Scanned images with columns 'path', 'mtime_ns' and 'size'.
+        hashes (np.ndarray): Hash of every image.
+        valid (np.ndarray): Boolean mask of the images with a computed hash.
+    """
+    __write_cache_file(cache_path, images, hashes, np.flatnonzero(valid))
+    for part_path in __part_paths(cache_path):
+        os.remove(part_path)
+
+
+def __save_cache_part(cache_path: str, images: pd.DataFrame, hashes: np.ndarray, rows: np.ndarray) -> None:
+    """
+    Append the hashes of newly hashed images to the cache as a small part file, merged by the next full save.
+
+    Args:
+        cache_path (str): Path to the .npz cache.
+        images (pd.DataFrame): Scanned images with columns 'path', 'mtime_ns' and 'size'.
+        hashes (np.ndarray): Hash of every image.
+        rows (np.ndarray): Rows of the images hashed since the last save.
+    """
+    part = len(__part_paths(cache_path))
+    __write_cache_file(f'{cache_path}.part{part:05d}.npz', images, hashes, rows)
+
+
+def __hash_file(args: Tuple[str, str]) -> Optional[int]:
+    """
+    Pool worker computing the hash of one image.
+    """
+    return compute_phash(os.path.join(*args))
+
+
+@profiled('duplicates.compute_hashes')
+def compute_hashes(root: str, cache_path: Optional[str] = None, processes: Optional[int] = None,
+                   chunksize: int = 256, save_every: int = 50000) -> pd.DataFrame:
+    """
+    Compute perceptual hashes of all images below a directory with a process pool.
+
+    Hashes are cached on disk, keyed by the relative path, modification time and size of the image, so reruns
+    only hash new or modified images. Every `save_every` hashed images, the new hashes are appended to the cache
+    as a small part file, so an interrupted run resumes where it stopped; the full cache is written once at the end.
+
+    Args:
+        root (str): The image directory.
+        cache_path (str or None): Path to the .npz cache, None disables caching.
+        processes (int or None): Number of worker processes, defaults to the number of CPUs.
+        chunksize (int): Number of images sent to a worker at once.
+        save_every (int): Number of newly hashed images between two saves of the cache.
+
+    Returns:
+        pd.DataFrame: Columns 'id' (file name), 'path' and 'hash', without unreadable images.
+    """
+    images = scan_images(root)
+    cache = __load_cache(cache_path)
+
+    # merging on the row position keeps the uint64 hashes from being cast to float by missing values
+    cache_rows = cache[['path', 'mtime_ns', 'size']].assign(cache_row=np.arange(len(cache)))
+    merged = images.merge(cache_rows, on=['path', 'mtime_ns', 'size'], how='left')
+    stale = merged['cache_row'].isna().to_numpy()
+    hashes = np.zeros(len(merged), dtype=np.uint64)
+    hashes[~stale] = cache['hash'].to_numpy(dtype=np.uint64)[merged.loc[~stale, 'cache_row'].to_numpy(dtype=np.int64)]
+    valid = ~stale
+
+    with stage('duplicates.hash_images', rows_in=int(stale.sum())):
+        stale_idx = np.flatnonzero(stale)
+        if len(stale_idx):
+            with multiprocessing.Pool(processes) as pool:
+                tasks = ((root, path) for path in merged['path'].to_numpy()[stale_idx])
+                pending = []
+                for count, (idx, value) in enumerate(zip(stale_idx, pool.imap(__hash_file, tasks,
+                                                                               chunksize=chunksize)), start=1):
+                    if value is not None:
+                        hashes[idx] = value
+                        valid[idx] = True
+                        pending.append(idx)
+                    if cache_path is not None and count % save_every == 0 and pending:
+                        __save_cache_part(cache_path, merged, hashes, np.array(pending))
+                        pending = []
+
+    if cache_path is not None:
+        __save_cache(cache_path, merged, hashes, valid)
+
+    paths = merged['path'].to_numpy(dtype=str)[valid]
+    return pd.DataFrame({'id': [os.path.basename(path) for path in paths], 'path': paths, 'hash': hashes[valid]})
+
+
+class MultiIndexHashTable:
+    """
+    Multi-index hash table over 64-bit hashes for Hamming-radius neighbour search.
+
+    Each hash is split into `radius + 1` disjoint substrings, and every substring is indexed in a sorted array.
+    By the pigeonhole principle, two hashes within the radius share at least one substring exactly, so only
+    hashes in the same bucket of some substring need to be compared.
+
+    Attributes:
+        hashes: The indexed uint64 hashes.
+        radius: The maximum Hamming distance of neighbours.
+        shifts: Bit offset of every substring.
+        widths: Bit width of every substring.
+        orders: For every substring, the permutation sorting the hashes by it.
+        sorted_keys: For every substring, the sorted substring values.
+    """
+    def __init__(self, hashes: np.ndarray, radius: int = 3):
+        """
+        Builds the substring indexes.
+
+        Args:
+            hashes (np.ndarray): Array of uint64 hashes.
+            radius (int): The maximum Hamming distance of neighbours.
+        """
+        if not 0 <= radius < _HASH_BITS:
+            raise ValueError(f"The radius must be between 0 and {_HASH_BITS - 1}.")
+
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.radius = radius
+
+        num_chunks = radius + 1
+        self.widths = [_HASH_BITS // num_chunks + (idx < _HASH_BITS % num_chunks) for idx in range(num_chunks)]
+        self.shifts = np.cumsum([0] + self.widths[:-1]).tolist()
+
+        self.orders: List[np.ndarray] = []
+        self.sorted_keys: List[np.ndarray] = []
+        for chunk in range(num_chunks):
+            keys = self.__keys(self.hashes, chunk)
+            order = np.argsort(keys, kind='stable')
+            self.orders.append(order)
+            self.sorted_keys.append(keys[order])
+
+    def __keys(self, hashes: np.ndarray, chunk: int) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The values of one substring of the hashes.
+        """
+        mask = np.uint64((1 << self.widths[chunk]) - 1)
+        return (hashes >> np.uint64(self.shifts[chunk])) & mask
+
+    def query(self, value: int) -> np.ndarray:
+        """
+        Finds all indexed hashes within the radius of a hash.
+
+        Args:
+            value (int): The query hash.
+
+        Returns:
+            np.ndarray: Sorted positions of the neighbours in `hashes`.
+        """
+        value = np.array([value], dtype=np.uint64)
+        candidates = []
+        for chunk, (order, sorted_keys) in enumerate(zip(self.orders, self.sorted_keys)):
+            key = self.__keys(value, chunk)
+            start, end = np.searchsorted(sorted_keys, key, side='left')[0], np.searchsorted(sorted_keys, key,
+                                                                                             side='right')[0]
+            candidates.append(order[start:end])
+
+        candidates = np.unique(np.concatenate(candidates))
+        return candidates[hamming_distance(self.hashes[candidates], np.repeat(value, len(candidates)))
+                          <= self.radius]
+
+    @profiled('duplicates.neighbour_pairs')
+    def pairs(self) -> np.ndarray:
+        """
+        Finds all pairs of indexed hashes within the radius.
+
+        Candidate pairs are enumerated bucket by bucket without materialising the buckets' cross products at once.
+
+        Returns:
+            np.ndarray: Array (pairs x 2) of positions in `hashes`, first position smaller, sorted and unique.
+        """
+        found = []
+        for order, sorted_keys in zip(self.orders, self.sorted_keys):
+            if len(sorted_keys) < 2:
+                continue
+
+            starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+            sizes = np.diff(np.r_[starts, len(sorted_keys)])
+            remaining = np.repeat(sizes, sizes) - (np.arange(len(sorted_keys)) - np.repeat(starts, sizes)) - 1
+
+            active = np.flatnonzero(remaining > 0)
+            offset = 1
+            while len(active):
+                first, second = order[active], order[active + offset]
+                close = hamming_distance(self.hashes[first], self.hashes[second]) <= self.radius
+                found.append(np.stack([np.minimum(first, second)[close], np.maximum(first, second)[close]], axis=1))
+
+                offset += 1
+                active = active[remaining[active] >= offset]
+
+        if not found:
+            return np.empty((0, 2), dtype=np.int64)
+
+        return np.unique(np.concatenate(found).astype(np.int64), axis=0)
+
+
+def __connected_components(num_nodes: int, pairs: np.ndarray) -> np.ndarray:
+    """
+    Label the connected components of an undirected graph by min-label propagation with pointer jumping.
+
+    Args:
+        num_nodes (int): Number of nodes.
+        pairs (np.ndarray): Array (edges x 2) of node positions.
+
+    Returns:
+        np.ndarray: The smallest node position of the component of every node.
+    """
+    labels = np.arange(num_nodes)
+    while True:
+        minimum = np.minimum(labels[pairs[:, 0]], labels[pairs[:, 1]])
+        updated = labels.copy()
+        np.minimum.at(updated, pairs[:, 0], minimum)
+        np.minimum.at(updated, pairs[:, 1], minimum)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+@profiled('duplicates.find_duplicates')
+def find_duplicates(hashes: pd.DataFrame, radius: int = 3) -> pd.DataFrame:
+    """
+    Groups exact and near-duplicate images by the Hamming distance of their perceptual hashes.
+
+    Identical hashes are collapsed first, so large sets of identical images do not blow up the pair search.
+
+    Every group gets one representative which is kept when duplicates are excluded: a training image if the
+    group contains one (validation images duplicating training images are all excluded), otherwise the
+    validation image with the lowest ID.
+
+    Args:
+        hashes (pd.DataFrame): Output of `compute_hashes`.
+        radius (int): The maximum Hamming distance of near-duplicates.
+
+    Returns:
+        pd.DataFrame: The input rows of all images having at least one duplicate, with added 'group' and
+        'is_representative' columns.
+    """
+    unique_hashes, inverse = np.unique(hashes['hash'].to_numpy(dtype=np.uint64), return_inverse=True)
+
+    table = MultiIndexHashTable(unique_hashes, radius=radius)
+    components = __connected_components(len(unique_hashes), table.pairs())
+
+    groups = components[inverse.ravel()]
+    group_sizes = np.bincount(groups, minlength=len(unique_hashes))
+
+    duplicates = hashes[group_sizes[groups] > 1].copy()
+    duplicates['group'] = pd.factorize(groups[group_sizes[groups] > 1], sort=True)[0]
+
+    duplicates['is_validation'] = is_validation_id(duplicates['id'])
+    duplicates = duplicates.sort_values(['group', 'is_validation', 'id']).reset_index(drop=True)
+    duplicates['is_representative'] = ~duplicates['group'].duplicated()
+
+    return duplicates.drop(columns=['is_validation'])
+
+
+def duplicate_ids(duplicates: pd.DataFrame, keep_representative: bool = True) -> List[str]:
+    """
+    Selects the IDs of duplicates to flag or exclude, e.g. with `DatasetSlicer.exclude_ids`.
+
+    Args:
+        duplicates (pd.DataFrame): Output of `find_duplicates`.
+        keep_representative (bool): Keep the representative of every group, otherwise select all members.
+
+    Returns:
+        List[str]: The selected IDs.
+    """
+    if keep_representative:
+        duplicates = duplicates[~duplicates['is_representative']]
+    return duplicates['id'].tolist()
+
+
+def mark_duplicates(datasets: Iterable[Any], duplicates: pd.DataFrame, keep_representative: bool = True) -> int:
+    """
+    Writes detected duplicates back into the entries of loaded datasets. The flags are exported as the
+    'is_duplicate' column of `entries_to_dataframe`, and `DatasetSlicer` drops the flagged rows.
+
+    Args:
+        datasets (Iterable[Dataset]): Datasets (see `base_dataset.Dataset`) with entries already set.
+        duplicates (pd.DataFrame): Output of `find_duplicates`.
+        keep_representative (bool): Leave the representative of every group unmarked, see `duplicate_ids`.
+
+    Returns:
+        int: Number of entries marked as duplicates.
+    """
+    ids = duplicate_ids(duplicates, keep_representative)
+    return sum(dataset.mark_duplicates(ids) for dataset in datasets)
@@ -0,0 +1,261 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Sequence, Union
+
+from eval_corrections.instrumentation import profiled
+from eval_corrections.verify_images.slicer import DatasetSlicer
+from eval_corrections.verify_images.utils import ALL_CATEGORIES, POPCOUNT
+
+CATEGORIES = ALL_CATEGORIES
+_MISSING_CATEGORY = 255
+_MAX_SOURCES = 8
+
+_LOWEST_BIT = np.array([(value & -value).bit_length() - 1 if value else 0 for value in range(256)], dtype=np.uint8)
+_VALIDATION = np.array([['+' * n_true + '*' * n_false for n_false in range(_MAX_SOURCES + 1)]
+                        for n_true in range(_MAX_SOURCES + 1)], dtype=object)
+
+
+class SourceProvenance:
+    """
+    Per-image provenance of the correction sources, stored as small integer bitmasks.
+
+    Bit `i` of every mask refers to the i-th source DataFrame. Two sources agree on an image when both the
+    category and the proposed labels are the same, which is the condition `filter_inconsistent_cats` and
+    `filter_inconsistent_labels` check on the intersections.
+
+    Attributes:
+        source_names: Names of the sources, in bit order.
+        ids: Sorted image IDs covered by at least one source.
+        covered: Bitmask of the sources containing the image.
+        validated: Bitmask of the sources that manually validated the image.
+        agreement: Matrix (images x sources), bitmask of the sources agreeing with the source of the column.
+        category_codes: Matrix (images x sources) of indices into `ALL_CATEGORIES`, 255 where not covered.
+        label_codes: Matrix (images x sources) of indices into `labels`, -1 where not covered.
+        labels: Vocabulary of the proposed labels strings.
+        original_label: Original label of the image, taken from the first source containing it.
+    """
+    def __init__(self, dfs: List[pd.DataFrame], source_names: Optional[List[str]] = None):
+        """
+        Builds the provenance bitmasks from the source DataFrames.
+
+        Args:
+            dfs (List[pd.DataFrame]): DataFrames of the sources with columns 'id', 'category', 'original_label',
+                'proposed_labels' and 'manually_validated'.
+            source_names (Optional[List[str]]): Names of the sources, defaults to their positions.
+        """
+        if not dfs:
+            raise ValueError("The list of dataframes is empty.")
+
+        if len(dfs) > _MAX_SOURCES:
+            raise ValueError(f"At most {_MAX_SOURCES} sources are supported.")
+
+        if source_names is None:
+            source_names = [str(idx) for idx in range(len(dfs))]
+        elif len(source_names) != len(dfs):
+            raise ValueError("The number of source names does not match the number of dataframes.")
+
+        self.source_names = list(source_names)
+        self.__build(dfs)
+
+    @classmethod
+    def from_slicer(cls, slicer: DatasetSlicer, source_names: Optional[List[str]] = None) -> 'SourceProvenance':
+        """
+        Builds the provenance of the DataFrames held by a DatasetSlicer.
+
+        Args:
+            slicer (DatasetSlicer): The slicer with the source DataFrames.
+            source_names (Optional[List[str]]): Names of the sources, defaults to their positions.
+
+        Returns:
+            SourceProvenance: The provenance of the slicer's sources.
+        """
+        return cls(slicer.dfs, source_names)
+
+    @profiled('provenance.build')
+    def __build(self, dfs: List[pd.DataFrame]) -> None:
+        """
+        Fills the bitmasks and code matrices from the source DataFrames.
+
+        Args:
+            dfs (List[pd.DataFrame]): DataFrames of the sources.
+        """
+        self.ids = np.unique(np.concatenate([df['id'].to_numpy(dtype=str) for df in dfs]))
+        id_index = pd.Index(self.ids)
+        num_images, num_sources = len(self.ids), len(dfs)
+
+        label_codes, self.labels = pd.factorize(pd.concat([df['proposed_labels'] for df in dfs], ignore_index=True),
+                                                use_na_sentinel=False)
+        self.labels = np.asarray(self.labels, dtype=object)
+
+        self.covered = np.zeros(num_images, dtype=np.uint8)
+        self.validated = np.zeros(num_images, dtype=np.uint8)
+        self.category_codes = np.full((num_images, num_sources), _MISSING_CATEGORY, dtype=np.uint8)
+        self.label_codes = np.full((num_images, num_sources), -1, dtype=np.int32)
+        self.original_label = np.full(num_images, -1, dtype=np.int32)
+
+        start = 0
+        for idx, df in enumerate(dfs):
+            rows = id_index.get_indexer(df['id'])
+            bit = np.uint8(1 << idx)
+
+            self.covered[rows] |= bit
+            self.validated[rows[df['manually_validated'].to_numpy(dtype=bool)]] |= bit
+            self.category_codes[rows, idx] = pd.Categorical(df['category'], categories=ALL_CATEGORIES).codes
+            self.label_codes[rows, idx] = label_codes[start:start + len(df)]
+            start += len(df)
+
+            unset = self.original_label[rows] == -1
+            self.original_label[rows[unset]] = df['original_label'].to_numpy()[unset]
+
+        self.agreement = np.zeros((num_images, num_sources), dtype=np.uint8)
+        for i in range(num_sources):
+            for j in range(num_sources):
+                same = ((self.category_codes[:, i] == self.category_codes[:, j])
+                        & (self.label_codes[:, i] == self.label_codes[:, j])
+                        & (self.label_codes[:, i] != -1))
+                self.agreement[same, i] |= np.uint8(1 << j)
+
+        self._rows = np.arange(num_images)
+
+    def source_mask(self, sources: Optional[Sequence[Union[str, int]]] = None) -> int:
+        """
+        Converts source names or positions into a bitmask.
+
+        Args:
+            sources (Optional[Sequence[Union[str, int]]]): Names or positions of the sources, None for all sources.
+
+        Returns:
+            int: The bitmask of the sources.
+        """
+        if sources is None:
+            return (1 << len(self.source_names)) - 1
+
+        mask = 0
+        for source in sources:
+            idx = self.source_names.index(source) if isinstance(source, str) else int(source)
+            if not 0 <= idx < len(self.source_names):
+                raise ValueError(f"Unknown source: {source}.")
+            mask |= 1 << idx
+        return mask
+
+    def agreement_mask(self, sources: Optional[Sequence[Union[str, int]]] = None) -> np.ndarray:
+        """
+        Bitmask of the selected sources agreeing with the first selected source containing the image.
+
+        Args:
+            sources (Optional[Sequence[Union[str, int]]]): Names or positions of the sources, None for all sources.
+
+        Returns:
+            np.ndarray: Bitmask per image over `ids`, 0 for images not contained in any selected source.
+        """
+        covered = self.covered & np.uint8(self.source_mask(sources))
+        return self.agreement[self._rows, _LOWEST_BIT[covered]] & covered
+
+    def clean_mask(self, sources: Optional[Sequence[Union[str, int]]] = None,
+                   categories: Optional[List[str]] = None, min_validated: int = 0) -> np.ndarray:
+        """
+        Derives the clean set for a subset of sources as a boolean mask over `ids`.
+
+        An image is clean if at least one of the selected sources contains it and all selected sources containing
+        it agree. Images contained in a single selected source are taken from that source.
+
+        Args:
+            sources (Optional[Sequence[Union[str, int]]]): Names or positions of the sources, None for all sources.
+            categories (Optional[List[str]]): Categories to remain, None keeps all categories.
+            min_validated (int): Minimum number of selected sources which manually validated the image.
+
+        Returns:
+            np.ndarray: Boolean mask over `ids`.
+        """
+        covered = self.covered & np.uint8(self.source_mask(sources))
+        reference = _LOWEST_BIT[covered]
+
+        mask = (covered != 0) & (self.agreement_mask(sources) == covered)
+
+        if categories is not None:
+            category_codes = np.flatnonzero(np.isin(ALL_CATEGORIES, categories))
+            mask &= np.isin(self.category_codes[self._rows, reference], category_codes)
+
+        if min_validated > 0:
+            mask &= POPCOUNT[self.validated & covered] >= min_validated
+
+        return mask
+
+    def clean_set(self, sources: Optional[Sequence[Union[str, int]]] = None,
+                  categories: Optional[List[str]] = None, min_validated: int = 0) -> pd.DataFrame:
+        """
+        Derives the clean set for a subset of sources, see `clean_mask`.
+
+        With all sources and categories ['A', 'B', 'M'], this matches `results/clean_validation.csv` (plus the
+        'category' column) when ReaL is one of the sources, since ReaL contains every validation image.
+
+        Args:
+            sources (Optional[Sequence[Union[str, int]]]): Names or positions of the sources, None for all sources.
+            categories (Optional[List[str]]): Categories to remain, None keeps all categories.
+            min_validated (int): Minimum number of selected sources which manually validated the image.
+
+        Returns:
+            pd.DataFrame: The clean set with columns 'id', 'category', 'validation', 'original_label' and
+            'proposed_labels', sorted by ID.
+        """
+        rows = np.flatnonzero(self.clean_mask(sources, categories, min_validated))
+        covered = self.covered[rows] & np.uint8(self.source_mask(sources))
+        reference = _LOWEST_BIT[covered]
+
+        num_validated = POPCOUNT[self.validated[rows] & covered]
+        num_not_validated = POPCOUNT[covered] - num_validated
+
+        return pd.DataFrame({
+            'id': self.ids[rows],
+            'category': ALL_CATEGORIES[self.category_codes[rows, reference]],
+            'validation': _VALIDATION[num_validated, num_not_validated],
+            'original_label': self.original_label[rows],
+            'proposed_labels': self.labels[self.label_codes[rows, reference]],
+        })
+
+    def category_counts(self, sources: Optional[Sequence[Union[str, int]]] = None,
+                        categories: Optional[List[str]] = None, min_validated: int = 0) -> Dict[str, int]:
+        """
+        Counts the images of the clean set per category, see `clean_mask`.
+
+        Returns:
+            Dict[str, int]: Number of clean images per category.
+        """
+        mask = self.clean_mask(sources, categories, min_validated)
+        reference = _LOWEST_BIT[self.covered[mask] & np.uint8(self.source_mask(sources))]
+        counts = np.bincount(self.category_codes[mask][np.arange(mask.sum()), reference], minlength=len(ALL_CATEGORIES))
+        return {category: int(count) for category, count in zip(ALL_CATEGORIES, counts[:len(ALL_CATEGORIES)])}
+
+    def save(self, path: str) -> None:
+        """
+        Saves the provenance into a compressed .npz file.
+
+        Args:
+            path (str): Path of the output file.
+        """
+        labels = pd.Series(self.labels, dtype=object)
+        np.savez_compressed(path, source_names=np.array(self.source_names), ids=self.ids, covered=self.covered,
+                            validated=self.validated, agreement=self.agreement, category_codes=self.category_codes,
+                            label_codes=self.label_codes, original_label=self.original_label,
+                            labels=labels.fillna('').to_numpy(dtype=str), labels_na=labels.isna().to_numpy())
+
+    @classmethod
+    def load(cls, path: str) -> 'SourceProvenance':
+        """
+        Loads the provenance saved by `save`.
+
+        Args:
+            path (str): Path of the .npz file.
+
+        Returns:
+            SourceProvenance: The loaded provenance.
+        """
+        data = np.load(path)
+        provenance = cls.__new__(cls)
+        provenance.source_names = data['source_names'].tolist()
+        for name in ['ids', 'covered', 'validated', 'agreement', 'category_codes', 'label_codes', 'original_label']:
+            setattr(provenance, name, data[name])
+        provenance.labels = data['labels'].astype(object)
+        provenance.labels[data['labels_na']] = np.nan
+        provenance._rows = np.arange(len(provenance.ids))
+        return provenance
@@ -0,0 +1,263 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Union
+
+from eval_corrections.instrumentation import profiled
+from eval_corrections.verify_images.provenance import SourceProvenance
+from eval_corrections.verify_images.slicer import DatasetSlicer
+from eval_corrections.verify_images.utils import (NUM_VAL_IMAGES, POPCOUNT, format_image_ids,
+                                                  load_problem_groups, parse_image_ids)
+
+Keys = Union[int, str, Iterable[Union[int, str]], None]
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    """
+    Marks an index array as read-only, so a caller modifying a result cannot corrupt the index.
+
+    Returns:
+        np.ndarray: The same array.
+    """
+    array.flags.writeable = False
+    return array
+
+
+def _build_inverted_index(keys: np.ndarray, numbers: np.ndarray) -> Dict[Union[int, str], np.ndarray]:
+    """
+    Build an inverted index from (key, image number) pairs.
+
+    Args:
+        keys (np.ndarray): Key of every pair.
+        numbers (np.ndarray): Image number of every pair.
+
+    Returns:
+        Dict: Sorted unique int32 image numbers of every key, as read-only views of one array.
+    """
+    if len(keys) == 0:
+        return {}
+
+    pairs = pd.DataFrame({'key': keys, 'number': numbers}).drop_duplicates().sort_values(['key', 'number'])
+    sorted_keys = pairs['key'].to_numpy()
+    bounds = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1], True])
+    postings = _read_only(pairs['number'].to_numpy(dtype=np.int32))
+    key_values = sorted_keys.tolist()
+
+    return {key_values[start]: postings[start:end] for start, end in zip(bounds[:-1], bounds[1:])}
+
+
+class CorrectionIndex:
+    """
+    Secondary indexes over the sliced correction data, answering compound queries with image-number arrays.
+
+    Images are identified by their 1-based validation image number; `to_ids` converts results back into file
+    names. Labels and categories are taken from the consolidated slices (`not_intersected_flat` and
+    `verified_flat`), coverage and agreement from the source DataFrames of the slicer.
+
+    Attributes:
+        category_index: Category -> images.
+        proposed_index: Class -> images whose consolidated proposed labels contain the class.
+        original_index: Class -> images with the class as the original label.
+        proposed_cluster_index: Problem group position -> images with a proposed label in the group.
+        original_cluster_index: Problem group position -> images with the original label in the group.
+        provenance: Source coverage and agreement bitmasks of every image.
+        covered: Coverage bitmask per image number.
+        disagreeing: Images contained in several sources which do not all agree.
+        agreeing: Images contained in several sources which all agree.
+    """
+    @profiled('query.build_index')
+    def __init__(self, slicer: DatasetSlicer, source_names: Optional[List[str]] = None,
+                 groups: Optional[List[Set[int]]] = None):
+        """
+        Builds the indexes from a DatasetSlicer on which the slicing has been run.
+
+        Args:
+            slicer (DatasetSlicer): The slicer with `not_intersected_flat` and `verified_flat` set.
+            source_names (Optional[List[str]]): Names of the slicer's sources, defaults to their positions.
+            groups (Optional[List[Set[int]]]): Classes of the problem groups, defaults to `load_problem_groups()`.
+        """
+        if slicer.not_intersected_flat is None or slicer.verified_flat is None:
+            raise ValueError("The slicer has no sliced DataFrames, run the slicing and concat_verified first.")
+
+        groups = load_problem_groups() if groups is None else groups
+
+        sliced = pd.concat([slicer.not_intersected_flat, slicer.verified_flat], ignore_index=True)
+        numbers = parse_image_ids(sliced['id'].to_numpy(dtype=str))
+        self.category_index = _build_inverted_index(sliced['category'].to_numpy(dtype=str), numbers)
+
+        labels = sliced['proposed_labels'].fillna('').astype(str).str.split(',')
+        labels = labels.apply(lambda row: [int(label) for label in row if label.strip()])
+        label_numbers = np.repeat(numbers, labels.str.len().to_numpy())
+        flat_labels = np.array([label for row in labels for label in row], dtype=np.int64)
+        self.proposed_index = _build_inverted_index(flat_labels, label_numbers)
+
+        self.provenance = SourceProvenance(slicer.dfs, source_names)
+        all_numbers = parse_image_ids(self.provenance.ids)
+        self.original_index = _build_inverted_index(self.provenance.original_label, all_numbers)
+
+        self.proposed_cluster_index = self.__cluster_index(self.proposed_index, groups)
+        self.original_cluster_index = self.__cluster_index(self.original_index, groups)
+
+        self.covered = np.zeros(NUM_VAL_IMAGES + 1, dtype=np.uint8)
+        self.covered[all_numbers] = self.provenance.covered
+
+        agreement = self.provenance.agreement_mask()
+        disagreeing = (POPCOUNT[self.provenance.covered] > 1) & (agreement != self.provenance.covered)
+        self.disagreeing = _read_only(np.sort(all_numbers[disagreeing]).astype(np.int32))
+        self.agreeing = _read_only(np.sort(all_numbers[(POPCOUNT[self.provenance.covered] > 1)
+                                                       & ~disagreeing]).astype(np.int32))
+
+        self.universe = _read_only(np.sort(all_numbers).astype(np.int32))
+        self._mask = np.zeros(NUM_VAL_IMAGES + 1, dtype=bool)
+
+    @staticmethod
+    def __cluster_index(label_index: Dict[int, np.ndarray], groups: List[Set[int]]) -> Dict[int, np.ndarray]:
+        """
+        Builds a problem group -> images index by merging the postings of the group's classes.
+
+        Returns:
+            Dict[int, np.ndarray]: Sorted image numbers of every group.
+        """
+        cluster_index = {}
+        for idx, group in enumerate(groups):
+            postings = [label_index[label] for label in group if label in label_index]
+            cluster_index[idx] = _read_only(np.unique(np.concatenate(postings)) if postings
+                                            else np.empty(0, dtype=np.int32))
+        return cluster_index
+
+    def intersect(self, *arrays: np.ndarray) -> np.ndarray:
+        """
+        Intersects sorted unique image-number arrays, starting from the smallest one.
+
+        Returns:
+            np.ndarray: Sorted image numbers contained in all arrays, a new array.
+        """
+        arrays = sorted(arrays, key=len)
+        result = arrays[0].copy()
+        for array in arrays[1:]:
+            if len(result) == 0:
+                break
+            self._mask[array] = True
+            result = result[self._mask[result]]
+            self._mask[array] = False
+        return result
+
+    def union(self, *arrays: np.ndarray) -> np.ndarray:
+        """
+        Unites sorted unique image-number arrays.
+
+        Returns:
+            np.ndarray: Sorted image numbers contained in any of the arrays, a new array.
+        """
+        if len(arrays) == 1:
+            return arrays[0].copy()
+
+        for array in arrays:
+            self._mask[array] = True
+        result = np.flatnonzero(self._mask).astype(np.int32)
+        self._mask[result] = False
+        return result
+
+    def difference(self, array: np.ndarray, *others: np.ndarray) -> np.ndarray:
+        """
+        Removes image numbers of other arrays from a sorted unique image-number array.
+
+        Returns:
+            np.ndarray: Sorted image numbers of the first array not contained in any other array, a new array.
+        """
+        for other in others:
+            self._mask[other] = True
+        result = array[~self._mask[array]]
+        for other in others:
+            self._mask[other] = False
+        return result
+
+    def __lookup(self, index: Dict, keys: Keys) -> Optional[np.ndarray]:
+        """
+        Unites the postings of one or more keys, None if no keys are given.
+        """
+        if keys is None:
+            return None
+        if isinstance(keys, (int, str, np.integer, np.str_)):
+            keys = [keys]
+        postings = [index.get(key) for key in np.asarray(keys).tolist()]
+        postings = [posting for posting in postings if posting is not None]
+        return self.union(*postings) if postings else np.empty(0, dtype=np.int32)
+
+    def covered_by(self, sources: Sequence[Union[str, int]]) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Sorted image numbers contained in all given sources.
+        """
+        mask = np.uint8(self.provenance.source_mask(sources))
+        return np.flatnonzero((self.covered & mask) == mask).astype(np.int32)
+
+    def query(self, category: Keys = None, proposed_label: Keys = None, original_label: Keys = None,
+              proposed_cluster: Keys = None, original_cluster: Keys = None, cluster: Keys = None,
+              sources: Optional[Sequence[Union[str, int]]] = None, disagree: Optional[bool] = None,
+              exclude: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Answers a conjunction of predicates by intersecting the indexes.
+
+        Every predicate accepts a single key or a list of keys, which are united. Predicates left as None are
+        ignored, so `query()` returns all indexed images.
+
+        Examples:
+            index.query(cluster=3, disagree=True)
+            index.query(category='B', proposed_cluster=5)
+            index.query(category='M', proposed_label=356)
+
+        Args:
+            category (Keys): Categories of the consolidated slices, e.g. 'B'.
+            proposed_label (Keys): Classes contained in the consolidated proposed labels.
+            original_label (Keys): Original labels.
+            proposed_cluster (Keys): Problem groups containing a proposed label.
+            original_cluster (Keys): Problem groups containing the original label.
+            cluster (Keys): Problem groups containing the original or a proposed label.
+            sources (Optional[Sequence[Union[str, int]]]): Sources which must all contain the image.
+            disagree (Optional[bool]): True for images on which the containing sources disagree, False for images
+                contained in several sources which all agree.
+            exclude (Optional[np.ndarray]): Image numbers to remove from the result, e.g. a previous query.
+
+        Returns:
+            np.ndarray: Sorted int32 image numbers, a new array which the caller may modify.
+        """
+        clusters = None
+        if cluster is not None:
+            clusters = self.union(self.__lookup(self.proposed_cluster_index, cluster),
+                                  self.__lookup(self.original_cluster_index, cluster))
+
+        candidates = [
+            self.__lookup(self.category_index, category),
+            self.__lookup(self.proposed_index, proposed_label),
+            self.__lookup(self.original_index, original_label),
+            self.__lookup(self.proposed_cluster_index, proposed_cluster),
+            self.__lookup(self.original_cluster_index, original_cluster),
+            clusters,
+            self.covered_by(sources) if sources is not None else None,
+        ]
+
+        if disagree is True:
+            candidates.append(self.disagreeing)
+        elif disagree is False:
+            candidates.append(self.agreeing)
+
+        candidates = [candidate for candidate in candidates if candidate is not None]
+        result = self.intersect(*candidates) if candidates else self.universe.copy()
+
+        if exclude is not None:
+            result = self.difference(result, np.asarray(exclude, dtype=np.int32))
+
+        return result
+
+    @staticmethod
+    def to_ids(numbers: np.ndarray) -> np.ndarray:
+        """
+        Converts image numbers into validation file names.
+
+        Args:
+            numbers (np.ndarray): Image numbers.
+
+        Returns:
+            np.ndarray: File names like 'ILSVRC2012_val_00000001.JPEG'.
+        """
+        return format_image_ids(numbers)
@@ -0,0 +1,203 @@
+import os
+
+import numpy as np
+import pandas as pd
+from typing import Iterable, Iterator, Optional, Union
+
+from eval_corrections.instrumentation import profiled
+from eval_corrections.verify_images.accuracy import CLEAN_VALIDATION_PATH
+from eval_corrections.verify_images.utils import NUM_VAL_IMAGES, is_validation_id, parse_image_ids
+
+SIDECAR_SUFFIX = '.labels.npy'
+
+FLAG_CLEAN = 1
+FLAG_DUPLICATE = 2
+FLAG_MANUALLY_VALIDATED = 4
+
+
+def sidecar_dtype(max_labels: int) -> np.dtype:
+    """
+    Record layout of a sidecar file, one fixed-size record per sample.
+
+    Args:
+        max_labels (int): Number of label slots per record, unused slots hold -1.
+
+    Returns:
+        np.dtype: The structured record dtype.
+    """
+    return np.dtype([('offset', np.int64), ('original_label', np.int16), ('validation', np.uint8),
+                     ('flags', np.uint8), ('num_labels', np.uint8), ('labels', np.int16, (max_labels,))])
+
+
+def encode_validation(validation: pd.Series) -> np.ndarray:
+    """
+    Encode validation strings like '++*' into one byte: manual validations in the high, others in the low nibble.
+
+    Args:
+        validation (pd.Series): Validation strings, as in `results/clean_validation.csv`.
+
+    Returns:
+        np.ndarray: The codes as uint8.
+    """
+    validation = validation.fillna('').astype(str)
+    return ((validation.str.count(r'\+').to_numpy() << 4) | validation.str.count(r'\*').to_numpy()).astype(np.uint8)
+
+
+def decode_validation(codes: np.ndarray) -> np.ndarray:
+    """
+    Decode validation codes written by `encode_validation` back into strings.
+
+    Args:
+        codes (np.ndarray): The uint8 codes.
+
+    Returns:
+        np.ndarray: The validation strings.
+    """
+    codes = np.asarray(codes, dtype=np.uint8)
+    return np.array(['+' * (code >> 4) + '*' * (code & 15) for code in codes.tolist()], dtype=object)
+
+
+def read_manifest(manifest: Union[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Load a shard manifest mapping image IDs to shards.
+
+    Args:
+        manifest (str or pd.DataFrame): CSV file or DataFrame with columns 'id', 'shard' and 'offset' (position
+            of the sample within its shard), optionally 'original_label' for images outside the clean set.
+
+    Returns:
+        pd.DataFrame: The manifest sorted by shard and offset.
+    """
+    if isinstance(manifest, str):
+        manifest = pd.read_csv(manifest)
+
+    missing = {'id', 'shard', 'offset'} - set(manifest.columns)
+    if missing:
+        raise ValueError(f"The manifest is missing columns: {sorted(missing)}.")
+
+    if manifest.duplicated(['shard', 'offset']).any():
+        raise ValueError("The manifest contains duplicate offsets within a shard.")
+
+    return manifest.sort_values(['shard', 'offset'], kind='stable').reset_index(drop=True)
+
+
+def __sidecar_name(shard: str) -> str:
+    """
+    Relative path of the sidecar file of a shard.
+
+    Relative shard paths keep their directories, so 'train/shard-0.tar' and 'val/shard-0.tar' do not overwrite each
+    other; absolute paths and paths leaving the current directory are reduced to their file name.
+
+    Args:
+        shard (str): Path of the shard, as in the manifest.
+
+    Returns:
+        str: The sidecar path relative to the output directory.
+    """
+    name = os.path.normpath(shard)
+    if os.path.isabs(name) or name.split(os.sep)[0] == os.pardir:
+        name = os.path.basename(name)
+    return name + SIDECAR_SUFFIX
+
+
+@profiled('shard_sidecars.export')
+def export_sidecars(manifest: Union[str, pd.DataFrame], output_dir: str,
+                    clean_validation: Union[str, pd.DataFrame] = CLEAN_VALIDATION_PATH,
+                    duplicate_ids: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    Writes one sidecar label file per shard, with records in the order of the samples in the shard.
+
+    Every sample of the manifest gets a record; samples outside the clean set, including training images, have the
+    FLAG_CLEAN bit unset and no labels, so a loader can zip the sidecar with the shard without any lookup. Their
+    original label is taken from the manifest's 'original_label' column, -1 if it has none.
+
+    Args:
+        manifest (str or pd.DataFrame): The shard manifest, see `read_manifest`.
+        output_dir (str): Directory of the sidecar files, named '<shard path><SIDECAR_SUFFIX>', see `__sidecar_name`.
+        clean_validation (str or pd.DataFrame): The clean validation set or the path to its CSV file.
+        duplicate_ids (Iterable[str] or None): IDs to flag with FLAG_DUPLICATE, e.g. from `find_duplicates`.
+
+    Returns:
+        pd.DataFrame: One row per shard with columns 'shard', 'path', 'num_samples' and 'num_clean'.
+    """
+    manifest = read_manifest(manifest)
+    if isinstance(clean_validation, str):
+        clean_validation = pd.read_csv(clean_validation)
+
+    numbers = parse_image_ids(clean_validation['id'].to_numpy(dtype=str))
+    labels = clean_validation['proposed_labels'].fillna('').astype(str).str.split(',')
+    labels = labels.apply(lambda row: [int(label) for label in row if label.strip()])
+    lengths = labels.str.len().to_numpy()
+    max_labels = int(max(lengths.max(initial=0), 1))
+
+    # dense per-image tables, indexed by the image number
+    size = NUM_VAL_IMAGES + 1
+    original_label = np.full(size, -1, dtype=np.int16)
+    validation = np.zeros(size, dtype=np.uint8)
+    flags = np.zeros(size, dtype=np.uint8)
+    num_labels = np.zeros(size, dtype=np.uint8)
+    label_table = np.full((size, max_labels), -1, dtype=np.int16)
+
+    original_label[numbers] = clean_validation['original_label'].to_numpy()
+    validation[numbers] = encode_validation(clean_validation['validation'])
+    # rows without any clean label stay outside the clean set, as in `CleanLabelIndex`
+    flags[numbers] = (np.where(lengths > 0, FLAG_CLEAN, 0)
+                      | np.where(validation[numbers] >> 4 > 0, FLAG_MANUALLY_VALIDATED, 0))
+    num_labels[numbers] = lengths
+    label_slots = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    label_table[np.repeat(numbers, lengths), label_slots] = np.array([label for row in labels for label in row],
+                                                                     dtype=np.int16)
+
+    # samples outside the validation set (e.g. training images) point to the empty row 0 of the tables
+    sample_ids = manifest['id'].astype(str)
+    is_validation = is_validation_id(sample_ids)
+    sample_numbers = np.zeros(len(manifest), dtype=np.int64)
+    sample_numbers[is_validation] = parse_image_ids(sample_ids[is_validation].to_numpy(dtype=str))
+
+    sample_labels = original_label[sample_numbers]
+    if 'original_label' in manifest.columns:
+        sample_labels = np.where(sample_labels < 0, manifest['original_label'].fillna(-1).to_numpy(), sample_labels)
+
+    sample_flags = flags[sample_numbers]
+    if duplicate_ids is not None:
+        sample_flags |= np.where(sample_ids.isin(set(map(str, duplicate_ids))), FLAG_DUPLICATE, 0).astype(np.uint8)
+
+    records = np.zeros(len(manifest), dtype=sidecar_dtype(max_labels))
+    records['offset'] = manifest['offset'].to_numpy()
+    records['original_label'] = sample_labels
+    records['validation'] = validation[sample_numbers]
+    records['flags'] = sample_flags
+    records['num_labels'] = num_labels[sample_numbers]
+    records['labels'] = label_table[sample_numbers]
+
+    shards = manifest['shard'].astype(str).to_numpy()
+    bounds = np.flatnonzero(np.r_[True, shards[1:] != shards[:-1], True])
+    paths = [os.path.join(output_dir, __sidecar_name(shards[start])) for start in bounds[:-1]]
+    colliding = pd.Series(paths)[pd.Series(paths).duplicated()]
+    if len(colliding):
+        raise ValueError(f"Several shards map to the same sidecar file: {sorted(set(colliding))}.")
+
+    summary = []
+    for start, end, path in zip(bounds[:-1], bounds[1:], paths):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.save(path, records[start:end])
+        summary.append({'shard': shards[start], 'path': path, 'num_samples': int(end - start),
+                        'num_clean': int((records['flags'][start:end] & FLAG_CLEAN).astype(bool).sum())})
+
+    return pd.DataFrame(summary)
+
+
+def iter_sidecar(path: str, batch_size: int = 1024) -> Iterator[np.ndarray]:
+    """
+    Streams the records of a sidecar file in sample order with sequential reads.
+
+    Args:
+        path (str): Path of the sidecar file.
+        batch_size (int): Number of records per batch.
+
+    Returns:
+        Iterator[np.ndarray]: Batches of structured records, see `sidecar_dtype`.
+    """
+    records = np.load(path, mmap_mode='r')
+    for start in range(0, len(records), batch_size):
+        yield np.array(records[start:start + batch_size])
@@ -1,14 +1,19 @@
 import pandas as pd
 import numpy as np
-from typing import List, Optional, Union, Set
+from typing import Iterable, List, Optional, Union, Set
+
+from eval_corrections.instrumentation import profiled
 
 
 class DatasetSlicer:
     """
     A class to handle slicing of a dataset and processing operations.
 
+    The slicer works on its own copies of the DataFrames, without excluded images and without the 'is_duplicate'
+    column; run the slicing on `dfs` (or the frames returned by `exclude_ids`), not on the frames passed in.
+
     Attributes:
-        dfs: A list of pandas DataFrames to be processed.
+        dfs: A list of pandas DataFrames to be processed, without excluded images.
         intersected: A list of DataFrames with intersected images.
         not_intersected_flat: A list of DataFrames with non-intersected images.
         intersected_same_cat: A list of DataFrames with intersected images in the same category.
@@ -16,13 +21,16 @@ class DatasetSlicer:
         verified: A list of DataFrames of images that have been verified.
         inconsistent_flat: A list of DataFrames of images with inconsistent labels_option.
         verified_flat: A concatenated DataFrame of all verified images.
+        excluded_ids: A set of image IDs removed from `dfs` and from the set of all IDs, e.g. duplicates.
     """
-    def __init__(self, dfs: List[pd.DataFrame]):
+    def __init__(self, dfs: List[pd.DataFrame], exclude_duplicates: bool = True):
         """
         Initializes the DatasetSlicer with a list of DataFrames.
 
         Args:
             dfs (List[pd.DataFrame]): A list of pandas DataFrames to be processed.
+            exclude_duplicates (bool): Exclude images flagged in an 'is_duplicate' column, as written by
+                `Dataset.mark_duplicates` and `entries_to_dataframe`.
         """
         self.dfs = dfs
 
@@ -39,6 +47,33 @@ class DatasetSlicer:
 
         self.verified_flat: Union[pd.DataFrame, None] = None
 
+        self.excluded_ids: Set[str] = set()
+
+        flagged_ids = set()
+        if exclude_duplicates:
+            for df in dfs:
+                if 'is_duplicate' in df.columns:
+                    flagged_ids |= set(df.loc[df['is_duplicate'].fillna(False).astype(bool), 'id'])
+        self.exclude_ids(flagged_ids)
+
+    def exclude_ids(self, ids: Iterable[str]) -> List[pd.DataFrame]:
+        """
+        Removes images from `dfs` and from the set of all IDs, e.g. `duplicate_ids(find_duplicates(...))`, which
+        keeps one representative per duplicate group. The DataFrames passed to the slicer are not modified, so the
+        slicing must be run on the returned frames (the new `dfs`) and must start after this call.
+
+        Args:
+            ids (Iterable[str]): IDs of the images to exclude.
+
+        Returns:
+            List[pd.DataFrame]: The filtered DataFrames, without the 'is_duplicate' column.
+        """
+        self.excluded_ids |= set(ids)
+        self.dfs = [df[~df['id'].isin(self.excluded_ids)].drop(columns=['is_duplicate'], errors='ignore')
+                    .reset_index(drop=True) for df in self.dfs]
+        return self.dfs
+
+    @profiled('slicer.get_all_ids')
     def get_all_ids(self, df_list: Optional[List[pd.DataFrame]] = None) -> Set[str]:
         """
         Retrieves all IDs from a list of DataFrames.
@@ -55,13 +90,14 @@ class DatasetSlicer:
                 np.core.defchararray.add("ILSVRC2012_val_", np.char.zfill(nums.astype(str), 8)),
                 ".JPEG"
             )
-            return set(arr)
+            return set(arr) - self.excluded_ids
 
         ids = []
         for df in df_list:
             ids += df['id'].tolist()
         return set(ids)
 
+    @profiled('slicer.get_not_intersected_ids')
     def get_not_intersected_ids(self, intersected_ids: Set, all_ids: Set = None) -> List[str]:
         """
         Returns a list of IDs that are present in `dataset_ids` but not in `intersected_ids`.
@@ -99,6 +135,7 @@ class DatasetSlicer:
         """
         return self.get_all_ids(self.verified)
 
+    @profiled('slicer.concat_verified')
     def concat_verified(self) -> pd.DataFrame:
         if self.verified is None:
             raise ValueError("The list of DataFrames is not initialized.")
@@ -0,0 +1,88 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from typing import Iterable, List, Set, Union
+
+NUM_CLASSES = 1000
+NUM_VAL_IMAGES = 50000
+
+VALIDATION_PREFIX = 'ILSVRC2012_val_'
+_ID_DIGITS = 8
+
+# every category a source can assign, e.g. X for images without any valid label and Z for unclear ones
+ALL_CATEGORIES = np.array(['A', 'B', 'M', 'X', 'Z'])
+# categories of the images kept in the clean validation set
+CLEAN_CATEGORIES = np.array(['A', 'B', 'M'])
+
+PROBLEM_GROUPS_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'classes', 'problem_groups',
+                                   'clusters.json')
+
+# number of set bits of every byte value, for counting sources in uint8 bitmasks
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def is_validation_id(image_ids: Union[Iterable[str], pd.Series]) -> np.ndarray:
+    """
+    Check which image IDs are validation file names.
+
+    Args:
+        image_ids: Image IDs, e.g. 'ILSVRC2012_val_00000001.JPEG' or training file names.
+
+    Returns:
+        np.ndarray: Boolean array, True for validation images.
+    """
+    return pd.Series(image_ids, dtype=object).astype(str).str.startswith(VALIDATION_PREFIX).to_numpy()
+
+
+def parse_image_ids(image_ids: Union[Iterable[str], Iterable[int], np.ndarray]) -> np.ndarray:
+    """
+    Convert validation image IDs into their 1-based image numbers.
+
+    Args:
+        image_ids: File names like 'ILSVRC2012_val_00000001.JPEG', or image numbers which are returned as they are.
+
+    Returns:
+        np.ndarray: The image numbers as int64.
+    """
+    image_ids = np.asarray(image_ids)
+    if image_ids.dtype.kind in 'iu':
+        return image_ids.astype(np.int64)
+
+    width = len(VALIDATION_PREFIX) + _ID_DIGITS
+    chars = image_ids.astype(f'U{width}').view(np.uint32).reshape(len(image_ids), width)
+    digits = chars[:, len(VALIDATION_PREFIX):].astype(np.int64) - ord('0')
+
+    if np.any((digits < 0) | (digits > 9)):
+        raise ValueError("Image IDs must be validation file names or image numbers.")
+
+    return digits @ (10 ** np.arange(_ID_DIGITS - 1, -1, -1, dtype=np.int64))
+
+
+def format_image_ids(numbers: Union[Iterable[int], np.ndarray]) -> np.ndarray:
+    """
+    Convert 1-based image numbers into validation file names, the inverse of `parse_image_ids`.
+
+    Args:
+        numbers: Image numbers.
+
+    Returns:
+        np.ndarray: File names like 'ILSVRC2012_val_00000001.JPEG'.
+    """
+    digits = np.char.zfill(np.asarray(numbers, dtype=np.int64).astype(str), _ID_DIGITS)
+    return np.char.add(np.char.add(VALIDATION_PREFIX, digits), '.JPEG')
+
+
+def load_problem_groups(file_path: str = PROBLEM_GROUPS_PATH) -> List[Set[int]]:
+    """
+    Load the classes of every problem group.
+
+    Args:
+        file_path (str): Path to the clusters JSON, defaults to `classes/problem_groups/clusters.json`.
+
+    Returns:
+        List[Set[int]]: The set of class indices of every group, in file order.
+    """
+    with open(file_path, 'r') as file:
+        return [set(int(label) for label in group['classes']) for group in json.load(file)]